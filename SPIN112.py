@@ -5,36 +5,108 @@ import requests
 import xml.etree.ElementTree as ET
 import asyncio  # asynchronous sleep and operations
 from telegram import Bot, InputFile, Update
-from telegram.ext import Application, ApplicationBuilder, CommandHandler, CallbackContext
+from telegram.ext import Application, ApplicationBuilder, CommandHandler, CallbackContext, filters
 from telegram.error import TimedOut, NetworkError, RetryAfter, BadRequest
 import logging
+from logging_setup import configure_logging, dropped_records, RateLimitFilter
 import time
-from datetime import datetime
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
 import json
+import hashlib
 from staticmap import StaticMap, CircleMarker, Polygon, Line
-from shapely.geometry import shape, Point  # shapely for geojson region matching
 from shapely.geometry import Polygon as ShapelyPolygon, Point as ShapelyPoint  # Import Shapely's Polygon and Point
-from PIL import Image, ImageEnhance
-from io import BytesIO
+from PIL import ImageEnhance
+from geodata import load_region_index
+from leader_lease import LeaderLease, LeaseLost
+from incident_clusters import IncidentClusterIndex
+from load_shedding import LoadShedder, NORMAL, NO_KEYWORD_MAPS, ALL_ONLY
+import metrics
+import profiling
+import memory_report
+import functools
+import signal
+import socket
 
 # Load environment variables from .env file
 load_dotenv()
 
-# Configure logging
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.CRITICAL,
-    handlers=[logging.FileHandler("SPIN112_bot_errors.log"), logging.StreamHandler()]
+# Configure logging: records are queued and written to a size-rotated file by a background thread,
+# and repetitive messages are rate limited, so a verbose level (e.g. SPIN112_LOG_LEVEL=INFO) does not
+# slow down the bot. Instances sharing a directory (SPIN112_LEASE_FILE set) must not rotate the same
+# file, so by default each writes its own, named after SPIN112_INSTANCE or the host name. The name
+# stays the same across restarts, so the rotation keeps the disk use bounded
+INSTANCE_NAME = os.getenv('SPIN112_INSTANCE') or socket.gethostname()
+configure_logging(
+    level=os.getenv('SPIN112_LOG_LEVEL', 'CRITICAL').upper(),
+    log_file=os.getenv('SPIN112_LOG_FILE',
+                       f"SPIN112_bot_errors.{INSTANCE_NAME}.log" if os.getenv('SPIN112_LEASE_FILE') else "SPIN112_bot_errors.log"),
+    max_bytes=int(os.getenv('SPIN112_LOG_MAX_BYTES', str(5 * 1024 * 1024))),
+    backup_count=int(os.getenv('SPIN112_LOG_BACKUPS', '3')),
+    rate_limit=RateLimitFilter(
+        burst=int(os.getenv('SPIN112_LOG_RATE_BURST', '20')),  # same message per interval before sampling
+        interval=float(os.getenv('SPIN112_LOG_RATE_INTERVAL', '60')),
+        sample=int(os.getenv('SPIN112_LOG_SAMPLE', '100')),  # then keep 1 in N (0: drop the rest)
+    ),
 )
 logger = logging.getLogger(__name__)
 
 # Retrieve variables from .env file
 TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
 TELEGRAM_GROUP_ID = os.getenv('TELEGRAM_GROUP_ID')
+# Optional Bot API server (e.g. a self-hosted one or a local stand-in), default api.telegram.org
+TELEGRAM_API_URL = os.getenv('SPIN112_TELEGRAM_API_URL')
 
 # Maximum number of reports to store in the JSON files
 MAX_STORED_REPORTS = 1000
 
+# Directory holding the JSON state files (point every instance at the same shared volume)
+STATE_DIR = os.getenv('SPIN112_STATE_DIR', '.')
+
+# Optional active/standby coordination. Every instance started with the same lease file
+# competes for it; only the holder fetches and posts, the others wait as hot standbys.
+LEASE_FILE = os.getenv('SPIN112_LEASE_FILE')
+LEASE_TTL = float(os.getenv('SPIN112_LEASE_TTL', '15'))  # seconds before a silent leader is replaced
+LEASE_HEARTBEAT = float(os.getenv('SPIN112_LEASE_HEARTBEAT', '3'))  # seconds between lease renewals
+
+# Incidents this close in space (metres) and time (minutes) are treated as one event:
+# the first is posted with a map, the rest as replies to it. Set the radius to 0 to disable.
+CLUSTER_RADIUS_M = float(os.getenv('SPIN112_CLUSTER_RADIUS_M', '300'))
+CLUSTER_WINDOW_MIN = float(os.getenv('SPIN112_CLUSTER_WINDOW_MIN', '45'))
+
+# Load shedding when new incidents pile up (e.g. after downtime): backlog sizes that switch to
+# no maps in keyword topics / text only / All topic only, the sizes that switch back, and the
+# seconds within which the newest incident should still be posted
+SHED_ENTER = tuple(int(n) for n in os.getenv('SPIN112_SHED_ENTER', '5,15,40').split(','))
+SHED_LEAVE = tuple(int(n) for n in os.getenv('SPIN112_SHED_LEAVE', '2,8,25').split(','))
+LATENCY_TARGET_S = float(os.getenv('SPIN112_LATENCY_TARGET_S', '120'))
+
+# Local HTTP port serving pipeline metrics on /metrics in the Prometheus text format (unset: off)
+METRICS_PORT = os.getenv('SPIN112_METRICS_PORT')
+METRICS_HOST = os.getenv('SPIN112_METRICS_HOST', '127.0.0.1')
+
+# On-demand profiling: SIGUSR1 or the /profile command (Telegram user IDs in SPIN112_ADMIN_IDS only)
+# captures cProfile stats and span traces of the next SPIN112_PROFILE_RUNS job runs
+PROFILE_DIR = os.getenv('SPIN112_PROFILE_DIR', os.path.join(STATE_DIR, 'profiles'))
+PROFILE_RUNS = int(os.getenv('SPIN112_PROFILE_RUNS', '3'))
+ADMIN_IDS = [int(user_id) for user_id in os.getenv('SPIN112_ADMIN_IDS', '').split(',') if user_id.strip()]
+
+# Low-memory mode for small hosts: no prepared region geometries kept for lookups, vecjiObseg
+# history kept as fingerprints, and freed memory handed back to the system after each map render
+LOW_MEMORY = os.getenv('SPIN112_LOW_MEMORY', '').lower() in ('1', 'true', 'yes')
+
+# Memory report (/memory command, log line every SPIN112_MEMORY_REPORT_INTERVAL seconds, /metrics)
+# against a budget in MB for the whole process and optional ones per subsystem ("geodata=10,maps=40").
+# Memory per subsystem needs tracemalloc, which costs CPU and memory: set SPIN112_MEMORY_TRACE_FRAMES
+# to the traceback depth to record (e.g. 10; 0: off)
+MEMORY_BUDGET_MB = float(os.getenv('SPIN112_MEMORY_BUDGET_MB', '0'))
+MEMORY_BUDGETS = memory_report.parse_budgets(os.getenv('SPIN112_MEMORY_BUDGETS', ''))
+MEMORY_TRACE_FRAMES = int(os.getenv('SPIN112_MEMORY_TRACE_FRAMES', '0'))
+MEMORY_REPORT_INTERVAL = float(os.getenv('SPIN112_MEMORY_REPORT_INTERVAL', '0'))
+
+# Start tracing before the geodata and state files are loaded
+memory_report.start_tracing(MEMORY_TRACE_FRAMES)
+
 # Verify if the variables are loaded correctly
 if not TELEGRAM_BOT_TOKEN or not TELEGRAM_GROUP_ID:
     logger.critical("Telegram bot token or group ID is missing. Please check your .env file.")
@@ -90,25 +162,117 @@ keywords_map = {
 }
 
 # Defining the RSS feed URL and incident details URL base
-rss_feed_url = "https://spin3.sos112.si/api/javno/ODRSS/false" # Samo preverjene intervencije
-# rss_feed_url = "https://spin3.sos112.si/api/javno/ODRSS/true" # Vse intervencije vključno z nepreverjenimi
+spin3_url = os.getenv('SPIN112_SPIN3_URL', "https://spin3.sos112.si")  # Overridable for local stand-ins
+rss_feed_url = f"{spin3_url}/api/javno/ODRSS/false" # Samo preverjene intervencije
+# rss_feed_url = f"{spin3_url}/api/javno/ODRSS/true" # Vse intervencije vključno z nepreverjenimi
 
-incident_details_url_base = "https://spin3.sos112.si/api/javno/lokacija/"
-vecji_obseg_url = "https://spin3.sos112.si/javno/assets/data/vecjiObseg.json"
+incident_details_url_base = f"{spin3_url}/api/javno/lokacija/"
+vecji_obseg_url = f"{spin3_url}/javno/assets/data/vecjiObseg.json"
 
 # File path for storing posted incidents
-posted_incidents_file = 'posted_incidents.json' # ID's only
-posted_vecji_obseg_file = 'posted_vecjiObseg.json'
+posted_incidents_file = os.path.join(STATE_DIR, 'posted_incidents.json') # ID's only
+posted_vecji_obseg_file = os.path.join(STATE_DIR, 'posted_vecjiObseg.json')
+# Topics already delivered for incidents that are still being posted (survives a failover)
+pending_deliveries_file = os.path.join(STATE_DIR, 'pending_deliveries.json')
 
 # GeoJSON file path for "regije" data and "občine" data
-geojson_file = "SR.geojson"
-ob_geojson_file = "OB.geojson"
+geojson_file = os.getenv('SPIN112_SR_GEOJSON', "SR.geojson")
+ob_geojson_file = os.getenv('SPIN112_OB_GEOJSON', "OB.geojson")
+
+# Optional map tile URL template overriding the map styles (e.g. a local tile cache or mirror)
+tile_url = os.getenv('SPIN112_TILE_URL')
 
 # Global variables to keep track of incidents
 fetched_incidents = set()
 posted_vecji_obseg = set()
 posted_incidents = {}
 
+# Journal of topics already delivered for unfinished incidents, shared by both jobs so neither
+# overwrites the other's entries; loaded once per leadership term (None: not loaded yet)
+pending_deliveries = None
+
+# Leader lease of this instance (None when running as the only instance)
+leader_lease = LeaderLease(LEASE_FILE, ttl=LEASE_TTL, heartbeat=LEASE_HEARTBEAT) if LEASE_FILE else None
+lost_leadership = False
+
+# Recent events, for grouping SPIN3 interventions that describe the same event
+incident_clusters = IncidentClusterIndex(CLUSTER_RADIUS_M, timedelta(minutes=CLUSTER_WINDOW_MIN)) if CLUSTER_RADIUS_M > 0 else None
+
+# Degradation level tracker, kept across runs for its hysteresis
+load_shedder = LoadShedder(SHED_ENTER, SHED_LEAVE, LATENCY_TARGET_S)
+
+# Pipeline metrics (see metrics.py), served when SPIN112_METRICS_PORT is set
+stage_seconds = metrics.histogram('spin112_stage_seconds', "Time spent in each pipeline stage", ['stage'])
+send_seconds = metrics.histogram('spin112_telegram_send_seconds', "Time per Telegram send including retries", ['topic', 'method'])
+telegram_sends = metrics.counter('spin112_telegram_sends', "Telegram sends by final outcome", ['topic', 'method', 'outcome'])
+telegram_retries = metrics.counter('spin112_telegram_retries', "Telegram send attempts that were retried", ['method', 'reason'])
+incidents_posted = metrics.counter('spin112_incidents_posted', "Incidents posted", ['source'])
+post_delay_seconds = metrics.histogram('spin112_post_delay_seconds', "Delay from nastanekCas to the incident being posted", [],
+                                       buckets=(30, 60, 120, 180, 300, 600, 900, 1800, 3600, 7200, 21600))
+newest_posted_incident_time = None  # Epoch seconds of the newest nastanekCas posted so far
+newest_posted_incident = metrics.gauge('spin112_newest_posted_incident_timestamp_seconds', "nastanekCas of the newest posted incident")
+newest_posted_incident.set_function(lambda: newest_posted_incident_time)
+newest_posted_incident_age = metrics.gauge('spin112_newest_posted_incident_age_seconds', "Seconds since nastanekCas of the newest posted incident")
+newest_posted_incident_age.set_function(lambda: time.time() - newest_posted_incident_time if newest_posted_incident_time else None)
+backlog_incidents = metrics.gauge('spin112_backlog_incidents', "New incidents waiting to be posted in the current run")
+shedding_level = metrics.gauge('spin112_load_shedding_level', "Current load shedding level (0 = normal)")
+shedding_level.set_function(lambda: load_shedder.level)
+is_leader = metrics.gauge('spin112_leader', "1 while this instance may post (holds the leader lease or runs alone)")
+is_leader.set_function(lambda: 1 if leader_lease is None or leader_lease.is_leader() else 0)
+resident_memory = metrics.gauge('spin112_resident_memory_bytes', "Resident set size of the process")
+resident_memory.set_function(memory_report.resident_memory_bytes)
+log_records_dropped = metrics.counter('spin112_log_records_dropped', "Log records dropped because the logging queue was full")
+log_records_dropped.set_function(dropped_records)
+memory_traced = metrics.gauge('spin112_memory_traced_bytes', "Memory traced per subsystem at the last memory report", ['subsystem'])
+memory_budget = metrics.gauge('spin112_memory_budget_bytes', "Configured memory budgets ('resident' for the whole process)", ['subsystem'])
+if MEMORY_BUDGET_MB:
+    memory_budget.labels(subsystem='resident').set(int(MEMORY_BUDGET_MB * memory_report.MB))
+for subsystem, budget in MEMORY_BUDGETS.items():
+    memory_budget.labels(subsystem=subsystem).set(budget)
+
+# Profiler for live job runs, disarmed until SIGUSR1 or /profile
+profiler = profiling.Profiler(PROFILE_DIR)
+# Job names accepted by /profile
+profiled_jobs = {'rss': 'auto_fetch_and_post', 'vecji': 'fetch_and_post_vecji_obseg'}
+
+# Topic ID -> topic name, for labelling sends
+topic_names = {topic_id: name for name, topic_id in topics.items()}
+
+# Decorator timing a pipeline stage (a plain or async function) into spin112_stage_seconds,
+# and into a span while the run is being profiled
+def timed_stage(stage):
+    child = stage_seconds.labels(stage=stage)
+
+    def decorate(func):
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with child.time(), profiling.span(stage):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with child.time(), profiling.span(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+# SPIN3 timestamps carry no zone; they are Slovenian wall-clock time whatever the host's timezone
+SPIN3_TIMEZONE = ZoneInfo('Europe/Ljubljana')
+
+# Function to record the freshness of a posted incident from its nastanekCas
+def record_posted_incident(nastanekCas):
+    global newest_posted_incident_time
+    incidents_posted.labels(source='rss').inc()
+    try:
+        posted_time = datetime.strptime(nastanekCas, '%Y-%m-%dT%H:%M:%S').replace(tzinfo=SPIN3_TIMEZONE).timestamp()
+    except (TypeError, ValueError):
+        return
+    post_delay_seconds.observe(max(0.0, time.time() - posted_time))
+    if newest_posted_incident_time is None or posted_time > newest_posted_incident_time:
+        newest_posted_incident_time = posted_time
+
 
 # Dictionary to map English day names to custom names
 custom_day_names = {
@@ -232,26 +396,21 @@ headers = {
     'Cache-Control': 'no-store,no-cache',
 }
 
-# Load geojson region data
-with open(geojson_file, 'r') as geo_file:
-    geojson_data = json.load(geo_file)
-    
-# Load OB geojson data
-with open(ob_geojson_file, 'r') as ob_file:
-    ob_geojson_data = json.load(ob_file)
+# Index the geojson region ("regije") and OB ("občine") data; the parsed files themselves are not kept
+sr_regions = load_region_index(geojson_file, 'SR_UIME', compact=LOW_MEMORY)
+ob_regions = load_region_index(ob_geojson_file, 'OB_UIME', compact=LOW_MEMORY)
+memory_report.trim_heap()
 
 # Function to determine the region based on coordinates
+@timed_stage('region')
 def get_region_from_coordinates(lat, lon):
-    point = Point(lon, lat)
-    for feature in geojson_data['features']:
-        polygon = shape(feature['geometry'])
-        if polygon.contains(point):
-            return feature['properties']['SR_UIME'].upper()
-    return None
+    region = sr_regions.find(lon, lat)
+    return region.upper() if region else None
 
 # START Večji obseg
 
 # Function to get OB region polygon and its centroid, with additional logging and validation
+@timed_stage('ob_region')
 def get_ob_region_and_centroid(obcinaNaziv):
     """
     Get the OB region polygon coordinates and its centroid from the given obcinaNaziv.
@@ -259,77 +418,92 @@ def get_ob_region_and_centroid(obcinaNaziv):
     Handles both Polygon and MultiPolygon cases, and validates the format.
     """
     try:
-        for feature in ob_geojson_data['features']:
-            # Check if the feature's OB_UIME matches the given obcinaNaziv
-            if feature['properties']['OB_UIME'].upper() == obcinaNaziv.upper():
-                # Extract the geometry type and coordinates
-                geometry_type = feature['geometry']['type']
-                geometry_coords = feature['geometry']['coordinates']
-                
-                # Log the geometry type and coordinates for debugging
-                logger.info(f"Geometry type for {obcinaNaziv}: {geometry_type}")
-                logger.info(f"Coordinates for {obcinaNaziv}: {geometry_coords}")
-
-                # Handle Polygon type
-                if geometry_type == 'Polygon':
-                    # GeoJSON Polygons have coordinates structured as: [[ [lon, lat], [lon, lat], ... ]]
-                    polygon_coords = geometry_coords[0]
-                    shapely_polygon = ShapelyPolygon(polygon_coords)
-                    centroid = shapely_polygon.centroid
-                    return polygon_coords, centroid
-                
-                # Handle MultiPolygon type (if needed)
-                elif geometry_type == 'MultiPolygon':
-                    # GeoJSON MultiPolygons have coordinates structured as: [[[ [lon, lat], [lon, lat], ... ]]]
-                    # Use the first polygon's coordinates within the MultiPolygon
-                    polygon_coords = geometry_coords[0][0]
-                    shapely_polygon = ShapelyPolygon(polygon_coords)
-                    centroid = shapely_polygon.centroid
-                    return polygon_coords, centroid
-
-                # Handle Point type if the coordinates are only a single point (fallback)
-                elif geometry_type == 'Point':
-                    point_coords = geometry_coords
-                    shapely_point = ShapelyPoint(point_coords[0], point_coords[1])
-                    return [point_coords], shapely_point  # Return as a single point in a list
-
-                else:
-                    logger.error(f"Unsupported geometry type for {obcinaNaziv}: {geometry_type}")
-                    return None, None
+        geometry = ob_regions.geometry(obcinaNaziv)
+        if geometry is not None:
+            # Extract the geometry type and coordinates
+            geometry_type = geometry['type']
+            geometry_coords = geometry['coordinates']
+            
+            # Log the geometry type and coordinates for debugging
+            logger.debug("Geometry type for %s: %s", obcinaNaziv, geometry_type)
+            logger.debug("Coordinates for %s: %s", obcinaNaziv, geometry_coords)
+
+            # Handle Polygon type
+            if geometry_type == 'Polygon':
+                # GeoJSON Polygons have coordinates structured as: [[ [lon, lat], [lon, lat], ... ]]
+                polygon_coords = geometry_coords[0]
+                shapely_polygon = ShapelyPolygon(polygon_coords)
+                centroid = shapely_polygon.centroid
+                return polygon_coords, centroid
+            
+            # Handle MultiPolygon type (if needed)
+            elif geometry_type == 'MultiPolygon':
+                # GeoJSON MultiPolygons have coordinates structured as: [[[ [lon, lat], [lon, lat], ... ]]]
+                # Use the first polygon's coordinates within the MultiPolygon
+                polygon_coords = geometry_coords[0][0]
+                shapely_polygon = ShapelyPolygon(polygon_coords)
+                centroid = shapely_polygon.centroid
+                return polygon_coords, centroid
+
+            # Handle Point type if the coordinates are only a single point (fallback)
+            elif geometry_type == 'Point':
+                point_coords = geometry_coords
+                shapely_point = ShapelyPoint(point_coords[0], point_coords[1])
+                return [point_coords], shapely_point  # Return as a single point in a list
+
+            else:
+                logger.error("Unsupported geometry type for %s: %s", obcinaNaziv, geometry_type)
+                return None, None
 
         # If no matching region is found
-        logger.warning(f"No matching region found for: {obcinaNaziv}")
+        logger.warning("No matching region found for: %s", obcinaNaziv)
     except Exception as e:
-        logger.error(f"Error in get_ob_region_and_centroid for {obcinaNaziv}: {e}")
+        logger.error("Error in get_ob_region_and_centroid for %s: %s", obcinaNaziv, e)
     return None, None
 
 
 # Fetch and parse vecjiObseg.json data
+@timed_stage('fetch_vecji_obseg')
 def get_vecji_obseg_data(url):
     try:
         response = requests.get(url, headers=headers, timeout=10)
         response.raise_for_status()
         return response.json()
     except requests.exceptions.RequestException as e:
-        logger.error(f"Failed to fetch vecjiObseg data: {e}")
+        logger.error("Failed to fetch vecjiObseg data: %s", e)
         return None
 
 # Function to handle retries for sending messages with a properly defined message parameter
-async def retry_send_message(bot, chat_id, text, message_thread_id=None, retries=5):
-    for attempt in range(retries):
-        try:
-            # Send message using bot, ensure parse_mode is set to html
-            await bot.send_message(chat_id=chat_id, text=text, parse_mode='HTML', message_thread_id=message_thread_id)
-            return
-        except BadRequest as e:
-            logger.error(f"Failed to send message: {e}")
-            if 'message thread not found' in str(e).lower():
-                logger.error(f"Invalid message thread ID: {message_thread_id}. Skipping this post.")
-                break
-            await asyncio.sleep(5)
+async def retry_send_message(bot, chat_id, text, message_thread_id=None, retries=5, reply_to_message_id=None):
+    topic = topic_names.get(message_thread_id, str(message_thread_id))
+    with send_seconds.labels(topic=topic, method='send_message').time():
+        for attempt in range(retries):
+            try:
+                # After a map render or a retry wait another instance may have taken over
+                fence()
+                # Send message using bot, ensure parse_mode is set to html. A reply whose message
+                # was deleted in the meantime is posted as a normal message instead
+                sent = await bot.send_message(chat_id=chat_id, text=text, parse_mode='HTML', message_thread_id=message_thread_id,
+                                              reply_to_message_id=reply_to_message_id, allow_sending_without_reply=True)
+                telegram_sends.labels(topic=topic, method='send_message', outcome='ok').inc()
+                return sent
+            except RetryAfter as e:
+                # Telegram flood control: wait as long as asked, then try again
+                telegram_retries.labels(method='send_message', reason='retry_after').inc()
+                logger.warning("Flood control while sending message, retrying in %s s", e.retry_after)
+                await asyncio.sleep(retry_after_seconds(e))
+            except BadRequest as e:
+                logger.error("Failed to send message: %s", e)
+                if 'message thread not found' in str(e).lower():
+                    logger.error("Invalid message thread ID: %s. Skipping this post.", message_thread_id)
+                    break
+                telegram_retries.labels(method='send_message', reason='bad_request').inc()
+                await asyncio.sleep(5)
+    telegram_sends.labels(topic=topic, method='send_message', outcome='failed').inc()
 
 
 # Function to create a static map image with polygon boundaries
+@timed_stage('render_polygon_map')
 def create_static_map_with_polygon(polygon_coordinates, filename='obcina_map.png', zoom=11, line_width=3, map_style='topo', saturation_level=0.7):
     """
     Create a static map image and draw a polygon border representing the region using Line object.
@@ -348,7 +522,7 @@ def create_static_map_with_polygon(polygon_coordinates, filename='obcina_map.png
     """
     # Check if polygon coordinates are provided
     if not polygon_coordinates:
-        print("Empty or invalid polygon coordinates provided. Cannot create map.")
+        logger.error("Empty or invalid polygon coordinates provided. Cannot create map.")
         return
 
     # Map style URL templates
@@ -360,7 +534,7 @@ def create_static_map_with_polygon(polygon_coordinates, filename='obcina_map.png
     }
 
     # Get the URL template based on the selected map style
-    url_template = style_urls.get(map_style, style_urls['topo'])
+    url_template = tile_url or style_urls.get(map_style, style_urls['topo'])
 
     try:
         # Create the static map with the chosen style
@@ -375,49 +549,39 @@ def create_static_map_with_polygon(polygon_coordinates, filename='obcina_map.png
         # Render the map with the line at the specified zoom level
         image = m.render(zoom=zoom)
 
-        # Save the rendered image to a BytesIO object
-        image_buffer = BytesIO()
-        image.save(image_buffer, format='PNG')
-        image_buffer.seek(0)  # Move cursor to the beginning of the BytesIO object
-
-        # Open the image using PIL from the BytesIO object
-        pil_image = Image.open(image_buffer)
-
-        # Apply the saturation filter using ImageEnhance
-        enhancer = ImageEnhance.Color(pil_image)
-        image_enhanced = enhancer.enhance(saturation_level)
-
-        # Save the enhanced image
-        image_enhanced.save(filename)
-        print(f"Static map with polygon border saved as {filename} with {map_style} style and reduced saturation.")
+        # Apply the saturation filter and save the image
+        save_desaturated_map(image, filename, saturation_level)
+        logger.info("Static map with polygon border saved as %s with %s style and reduced saturation.", filename, map_style)
     except Exception as e:
-        print(f"Failed to create static map with polygon border. Error: {e}")
+        logger.error("Failed to create static map with polygon border. Error: %s", e)
         
 # Function to determine the region based on a centroid point and SR.geojson regions
 def get_region_from_centroid(centroid):
     """
     Determine the region based on the centroid point using SR.geojson data.
     """
-    for feature in geojson_data['features']:
-        polygon = shape(feature['geometry'])
-        if polygon.contains(centroid):
-            return feature['properties']['SR_UIME'].upper()
-    return None
+    region = sr_regions.find(centroid.x, centroid.y)
+    return region.upper() if region else None
 
 # Function to create a shapely polygon from OB coordinates and get its centroid
 def get_centroid_of_ob_region(obcinaNaziv):
     """
     Get the centroid of the OB region polygon from the given obcinaNaziv.
     """
-    for feature in ob_geojson_data['features']:
-        if feature['properties']['OB_UIME'].upper() == obcinaNaziv.upper():
-            polygon_coords = feature['geometry']['coordinates'][0][0]
-            shapely_polygon = ShapelyPolygon(polygon_coords)
-            return shapely_polygon.centroid  # Return the centroid of the polygon
+    geometry = ob_regions.geometry(obcinaNaziv)
+    if geometry is not None:
+        polygon_coords = geometry['coordinates'][0][0]
+        shapely_polygon = ShapelyPolygon(polygon_coords)
+        return shapely_polygon.centroid  # Return the centroid of the polygon
     return None
 
 # Function to post vecjiObseg incidents to the Večji obseg topic with enhanced error handling
-async def post_vecji_obseg_incidents(bot, incident):
+async def post_vecji_obseg_incidents(bot, incident, pending=None):
+    # Topics already delivered by a previous (possibly crashed) leader are skipped.
+    # Returns True if at least one send got through.
+    if pending is None:
+        pending = {}
+    incident_key = f"vecji:{vecji_obseg_fingerprint(incident)}"
     try:
         obcinaNaziv = incident.get('obcinaNaziv', 'N/A')
         besedilo = incident['besediloList'][0].get('besedilo', 'N/A')
@@ -430,12 +594,12 @@ async def post_vecji_obseg_incidents(bot, incident):
         ob_region, centroid = get_ob_region_and_centroid(obcinaNaziv)
 
         if not ob_region or not centroid:
-            logger.warning(f"Region or centroid not found for: {obcinaNaziv}. Skipping map creation.")
+            logger.warning("Region or centroid not found for: %s. Skipping map creation.", obcinaNaziv)
             ob_map_text = ""
         else:
             # Determine the region name from centroid coordinates
             region_name = get_region_from_centroid(centroid)
-            logger.info(f"Centroid for {obcinaNaziv}: {centroid}. Region: {region_name}")
+            logger.info("Centroid for %s: %s. Region: %s", obcinaNaziv, centroid, region_name)
 
             # Check if polygon coordinates are valid for plotting
             if ob_region and isinstance(ob_region, list) and all(isinstance(point, list) and len(point) == 2 for point in ob_region):
@@ -443,7 +607,7 @@ async def post_vecji_obseg_incidents(bot, incident):
                 create_static_map_with_polygon(ob_region, filename='obcina_map.png')
                 ob_map_text = f"\nMap region: {obcinaNaziv} with boundaries plotted."
             else:
-                logger.error(f"Invalid polygon data for {obcinaNaziv}: {ob_region}")
+                logger.error("Invalid polygon data for %s (%s points)", obcinaNaziv, len(ob_region))
                 ob_map_text = f"\nMap region: {obcinaNaziv} (Polygon data unavailable)."
 
         # Construct the message
@@ -456,61 +620,96 @@ async def post_vecji_obseg_incidents(bot, incident):
 
         # Determine the topic ID based on the region name from the centroid
         region_topic_id = topics.get(region_name, topics["Večji obseg"])  # Default to Večji obseg if region not found
-        logger.info(f"Posting incident for region: {region_name} in topic ID: {region_topic_id}")
+        logger.info("Posting incident for region: %s in topic ID: %s", region_name, region_topic_id)
+
+        # Whether any of the sends got through
+        posted = False
+
+        async def send_photo(message_thread_id=None):
+            nonlocal posted
+            sent = await retry_send_photo(bot, TELEGRAM_GROUP_ID, 'obcina_map.png', message, message_thread_id=message_thread_id)
+            posted = posted or sent is not None
+            return sent
 
         # Send the message and map to the Region-specific topic
-        await retry_send_photo(bot, TELEGRAM_GROUP_ID, 'obcina_map.png', message, message_thread_id=region_topic_id)
+        await deliver_once(pending, incident_key, "Region", lambda: send_photo(region_topic_id))
 
         # Send the message and map to the Večji obseg topic
         vecji_obseg_topic_id = topics["Večji obseg"]
-        logger.info(f"Posting incident to Večji obseg topic (ID: {vecji_obseg_topic_id})")
-        await retry_send_photo(bot, TELEGRAM_GROUP_ID, 'obcina_map.png', message, message_thread_id=vecji_obseg_topic_id)
+        logger.info("Posting incident to Večji obseg topic (ID: %s)", vecji_obseg_topic_id)
+        await deliver_once(pending, incident_key, "Večji obseg", lambda: send_photo(vecji_obseg_topic_id))
 
         # Send the message and map to the All topic (no message_thread_id for main group)
         logger.info("Posting incident to the All topic (main group)")
-        await retry_send_photo(bot, TELEGRAM_GROUP_ID, 'obcina_map.png', message)
+        await deliver_once(pending, incident_key, "All", lambda: send_photo())
+        return posted
 
+    except LeaseLost:
+        raise
     except Exception as e:
-        logger.error(f"An error occurred while posting vecji obseg incidents: {e}")
+        logger.error("An error occurred while posting vecji obseg incidents: %s", e)
 
         
-# Function to read posted vecjiObseg incidents (as full JSON objects)
+# Function to read posted vecjiObseg incidents (full JSON objects, or fingerprints in low-memory mode)
 def read_posted_vecji_obseg(file_path):
     try:
         with open(file_path, 'r', encoding='utf-8') as file:
-            return json.load(file)  # Load the entire list of incident JSON objects
+            incident_list = json.load(file)  # Load the entire list of incident JSON objects
     except (FileNotFoundError, json.JSONDecodeError):
         return []
+    if LOW_MEMORY:
+        # Keep only fingerprints, also of the full objects written before
+        incident_list = [incident if isinstance(incident, str) else vecji_obseg_fingerprint(incident)
+                         for incident in incident_list]
+    return incident_list
 
-# Function to write posted vecjiObseg incidents (as full JSON objects)
+# Function to write posted vecjiObseg incidents (full JSON objects, or fingerprints in low-memory mode)
 def write_posted_vecji_obseg(file_path, incident_list):
     # Keep only the most recent MAX_STORED_REPORTS incidents
     if len(incident_list) > MAX_STORED_REPORTS:
         incident_list = incident_list[-MAX_STORED_REPORTS:]
 
     # Write the limited list of incidents back to the JSON file
-    with open(file_path, 'w', encoding='utf-8') as file:
-        json.dump(incident_list, file, ensure_ascii=False, indent=4)
+    write_json_atomic(file_path, incident_list)
+
+# Function to build a stable key for a vecjiObseg incident (these events do not have IDs)
+def vecji_obseg_fingerprint(incident):
+    canonical = json.dumps(incident, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(canonical.encode('utf-8')).hexdigest()
         
 # Function to compare if two incidents are the same based on content
 def is_duplicate_incident(new_incident, posted_incidents):
     """
     Check if the new incident is a duplicate by comparing it with each posted incident.
+    Posted incidents stored as fingerprints (low-memory mode) are compared by fingerprint.
     """
+    fingerprint = None
     for posted_incident in posted_incidents:
+        if isinstance(posted_incident, str):
+            if fingerprint is None:
+                fingerprint = vecji_obseg_fingerprint(new_incident)
+            if fingerprint == posted_incident:
+                return True
         # Compare the entire JSON object of both incidents
-        if new_incident == posted_incident:
+        elif new_incident == posted_incident:
             return True
     return False
 
 # Function to fetch and post new vecjiObseg incidents automatically
+@profiler.job('fetch_and_post_vecji_obseg')
+@timed_stage('fetch_and_post_vecji_obseg')
 async def fetch_and_post_vecji_obseg(context: CallbackContext):
     global posted_vecji_obseg
     
+    # Only the instance holding the leader lease posts
+    if not have_leadership(context):
+        return
+
     logger.info("Checking for new vecjiObseg incidents...")  # Log the start of the check
 
-    # Load posted incidents from the JSON file
+    # Load posted incidents from the JSON file, and the delivery journal
     posted_vecji_obseg = read_posted_vecji_obseg(posted_vecji_obseg_file)
+    pending = get_pending_deliveries()
 
     # Get the vecjiObseg data
     vecji_obseg_data = get_vecji_obseg_data(vecji_obseg_url)
@@ -518,15 +717,24 @@ async def fetch_and_post_vecji_obseg(context: CallbackContext):
         logger.warning("Failed to fetch or parse vecjiObseg data.")  # Log if data fetch fails
         return
 
-    for incident in vecji_obseg_data['value']:
-        # Check if the incident has already been posted based on its content
-        if not is_duplicate_incident(incident, posted_vecji_obseg):
-            logger.info(f"New vecjiObseg incident found: ID {incident}. Posting...")  # Log the new incident found
-            await post_vecji_obseg_incidents(context.bot, incident)
-            posted_vecji_obseg.append(incident)  # Add the new incident to the list
-            write_posted_vecji_obseg(posted_vecji_obseg_file, posted_vecji_obseg)
-        else:
-            logger.info(f"Incident ID {incident} is already posted. Skipping.")  # Log if the incident is already posted
+    try:
+        for incident in vecji_obseg_data['value']:
+            # Check if the incident has already been posted based on its content
+            if not is_duplicate_incident(incident, posted_vecji_obseg):
+                logger.info("New vecjiObseg incident found for %s. Posting...", incident.get('obcinaNaziv'))  # Log the new incident found
+                with profiling.span('vecji_obseg_incident', obcina=incident.get('obcinaNaziv')):
+                    posted = await post_vecji_obseg_incidents(context.bot, incident, pending)
+                # Add the new incident to the list
+                posted_vecji_obseg.append(vecji_obseg_fingerprint(incident) if LOW_MEMORY else incident)
+                fence()
+                write_posted_vecji_obseg(posted_vecji_obseg_file, posted_vecji_obseg)
+                if posted:
+                    incidents_posted.labels(source='vecji_obseg').inc()
+                complete_deliveries(pending, f"vecji:{vecji_obseg_fingerprint(incident)}")
+            else:
+                logger.debug("vecjiObseg incident for %s is already posted. Skipping.", incident.get('obcinaNaziv'))  # Log if the incident is already posted
+    except LeaseLost as e:
+        step_down(context, e)
             
 # END Večji obseg
 
@@ -542,23 +750,56 @@ def match_keywords_in_dogodek(dogodekNaziv):
             matched_topics.append(topic)
     return matched_topics
 
+# Function to get the flood control wait in seconds (newer python-telegram-bot versions use a timedelta)
+def retry_after_seconds(error):
+    retry_after = error.retry_after
+    return retry_after.total_seconds() if isinstance(retry_after, timedelta) else retry_after
+
 # Function to handle retries for sending photos
 async def retry_send_photo(bot, chat_id, photo, caption, message_thread_id=None, retries=5):
-    for attempt in range(retries):
+    topic = topic_names.get(message_thread_id, str(message_thread_id))
+    with send_seconds.labels(topic=topic, method='send_photo').time():
+        for attempt in range(retries):
+            try:
+                # After a map render or a retry wait another instance may have taken over
+                fence()
+                with open(photo, 'rb') as img_file:
+                    sent = await bot.send_photo(chat_id=chat_id, photo=InputFile(img_file), caption=caption, parse_mode='HTML', message_thread_id=message_thread_id)
+                telegram_sends.labels(topic=topic, method='send_photo', outcome='ok').inc()
+                return sent
+            except RetryAfter as e:
+                # Telegram flood control: wait as long as asked, then try again
+                telegram_retries.labels(method='send_photo', reason='retry_after').inc()
+                logger.warning("Flood control while sending photo, retrying in %s s", e.retry_after)
+                await asyncio.sleep(retry_after_seconds(e))
+            except BadRequest as e:
+                logger.error("Failed to send photo: %s", e)
+                if 'message thread not found' in str(e).lower():
+                    logger.error("Invalid message thread ID: %s. Skipping this post.", message_thread_id)
+                    break
+                telegram_retries.labels(method='send_photo', reason='bad_request').inc()
+                await asyncio.sleep(5)
+    telegram_sends.labels(topic=topic, method='send_photo', outcome='failed').inc()
+
+
+
+# Function to apply the saturation filter to a rendered map and save it. The images are closed
+# right away, so their pixel data is freed now rather than whenever they are garbage collected
+def save_desaturated_map(image, filename, saturation_level):
+    try:
+        image_enhanced = ImageEnhance.Color(image).enhance(saturation_level)
         try:
-            with open(photo, 'rb') as img_file:
-                await bot.send_photo(chat_id=chat_id, photo=InputFile(img_file), caption=caption, parse_mode='HTML', message_thread_id=message_thread_id)
-            return
-        except BadRequest as e:
-            logger.error(f"Failed to send photo: {e}")
-            if 'message thread not found' in str(e).lower():
-                logger.error(f"Invalid message thread ID: {message_thread_id}. Skipping this post.")
-                break
-            await asyncio.sleep(5)
-
+            image_enhanced.save(filename)
+        finally:
+            image_enhanced.close()
+    finally:
+        image.close()
+    if LOW_MEMORY:
+        memory_report.trim_heap()
 
 
 # Create a static map image
+@timed_stage('render_incident_map')
 def create_static_map_image(lat, lon, filename='incident_map.png', zoom=14, map_style='topo', saturation_level=0.7):
     """
     Create a static map image with a marker at the specified latitude and longitude.
@@ -583,41 +824,33 @@ def create_static_map_image(lat, lon, filename='incident_map.png', zoom=14, map_
     }
 
     # Get the URL template based on the selected map style
-    url_template = style_urls.get(map_style, style_urls['topo'])
+    url_template = tile_url or style_urls.get(map_style, style_urls['topo'])
 
     # Create the static map with the chosen style
     m = StaticMap(800, 600, url_template=url_template)
     marker = CircleMarker((lon, lat), 'red', 12)
     m.add_marker(marker)
 
-    # Render the map with the marker at the specified zoom level and save to a BytesIO object
-    image_buffer = BytesIO()
+    # Render the map with the marker at the specified zoom level
     image = m.render(zoom=zoom)  # Render the image using StaticMap
-    image.save(image_buffer, format='PNG')
-    image_buffer.seek(0)  # Move cursor to the beginning of the BytesIO object
-
-    # Open the image using PIL from the BytesIO object
-    pil_image = Image.open(image_buffer)
-
-    # Apply the saturation filter using ImageEnhance
-    enhancer = ImageEnhance.Color(pil_image)
-    image_enhanced = enhancer.enhance(saturation_level)
 
-    # Save the enhanced image
-    image_enhanced.save(filename)
-    print(f"Map saved as {filename} with reduced saturation.")
+    # Apply the saturation filter and save the image
+    save_desaturated_map(image, filename, saturation_level)
+    logger.info("Map saved as %s with reduced saturation.", filename)
 
 
 # Fetch and parse RSS feed
+@timed_stage('fetch_rss')
 def get_rss_feed(url):
     try:
         response = requests.get(url, headers=headers, timeout=10)
         response.raise_for_status()
         return response.content
     except requests.exceptions.RequestException as e:
-        logger.error(f"Failed to fetch RSS feed: {e}")
+        logger.error("Failed to fetch RSS feed: %s", e)
         return None
 
+@timed_stage('parse_rss')
 def parse_rss_feed(rss_content):
     if not rss_content:
         return []
@@ -640,6 +873,7 @@ def parse_rss_feed(rss_content):
     return incidents
 
 # Function to get incident details
+@timed_stage('details')
 def get_incident_details(link_suffix):
     incident_url = f"{incident_details_url_base}{link_suffix}"
     try:
@@ -647,19 +881,11 @@ def get_incident_details(link_suffix):
         response.raise_for_status()
         return response.json()
     except requests.exceptions.RequestException as e:
-        logger.error(f"Failed to fetch incident details for {link_suffix}: {e}")
+        logger.error("Failed to fetch incident details for %s: %s", link_suffix, e)
         return None
 
-# Function to post incident data to the Telegram group topic
-async def post_incident_to_topic(bot, incident, topic_id):
-    detailed_data = get_incident_details(incident['link_suffix'])
-    if not detailed_data or 'value' not in detailed_data:
-        return
-
-    details = detailed_data['value']
-    # Log entire details to check the structure and data types
-    # logger.debug(f"Incident ID: {incident['id']}, Full Details: {details}")
-    
+# Function to build the HTML message for an incident from its details
+def build_incident_message(incident, details):
     lat = details.get('wgsLat', None)
     lon = details.get('wgsLon', None)
     dogodekNaziv = details.get('dogodekNaziv', '')
@@ -709,30 +935,37 @@ async def post_incident_to_topic(bot, incident, topic_id):
         f"ID: <a href='https://spin3.sos112.si/javno/zemljevid/{incident['id']}'>{incident['id']}</a>"
     )
 
-    if topic_id is None:
-        # Send to the main thread of the supergroup (without message_thread_id)
-        if lat and lon:
-            create_static_map_image(lat, lon)
-            await retry_send_photo(bot, TELEGRAM_GROUP_ID, 'incident_map.png', message)
-        else:
-            await retry_send_message(bot, TELEGRAM_GROUP_ID, message)
-    else:
-        # Send to the specified topic (sub-thread) using message_thread_id
-        if lat and lon:
-            create_static_map_image(lat, lon)
-            await retry_send_photo(bot, TELEGRAM_GROUP_ID, 'incident_map.png', message, message_thread_id=topic_id)
-        else:
-            await retry_send_message(bot, TELEGRAM_GROUP_ID, message, message_thread_id=topic_id)
+    return message
+
+# Function to send a built incident message to the main thread (topic_id None) or a topic
+async def send_incident(bot, message, topic_id, map_file=None, reply_to_message_id=None):
+    """
+    Send the incident with its map when map_file is given, as plain text otherwise.
+    A reply (reply_to_message_id) is always sent as text. Returns the sent message.
+    """
+    if map_file and reply_to_message_id is None:
+        return await retry_send_photo(bot, TELEGRAM_GROUP_ID, map_file, message, message_thread_id=topic_id)
+    return await retry_send_message(bot, TELEGRAM_GROUP_ID, message, message_thread_id=topic_id,
+                                    reply_to_message_id=reply_to_message_id)
 
 # Function to fetch and post new incidents automatically every 3 minutes
-async def auto_fetch_and_post(context: CallbackContext, initial_run=False):
+@profiler.job('auto_fetch_and_post')
+@timed_stage('auto_fetch_and_post')
+async def auto_fetch_and_post(context: CallbackContext):
     global fetched_incidents
-    
+
+    # Only the instance holding the leader lease posts
+    if not have_leadership(context):
+        return
+
     logger.info("Checking for new incidents in the RSS feed...")  # Log the start of the check
 
     if not fetched_incidents:
         fetched_incidents.update(read_posted_incidents(posted_incidents_file))
 
+    # Topics already delivered for incidents a previous leader did not finish
+    pending = get_pending_deliveries()
+
     # Fetch RSS content
     rss_content = get_rss_feed(rss_feed_url)
     incidents = parse_rss_feed(rss_content)
@@ -741,72 +974,147 @@ async def auto_fetch_and_post(context: CallbackContext, initial_run=False):
         logger.warning("No incidents found in the RSS feed.")  # Log if no incidents are found
         return
     
-    # Reverse the order of incidents if it's the initial run
-    if initial_run:
-        incidents.reverse()  # Post oldest first for the initial run
-
-    # Loop through and post each incident
-    for incident in incidents:
-        incident_id = incident['id']
-        logger.info(f"Checking incident ID: {incident_id}")  # Log the incident being checked
-        
-        if incident['id'] not in fetched_incidents:
-            logger.info(f"New incident found: ID {incident_id}. Posting...")  # Log the new incident found
-            # Variable to track if the incident is posted in any topic
-            posted_anywhere = False
-
-            # First, post to the general "All" topic if not posted to any category-specific topics
-            await post_incident_to_topic(context.bot, incident, topics["All"])
-
-            # Get incident details and check for further categorization
-            detailed_data = get_incident_details(incident['link_suffix'])
-            if detailed_data and 'value' in detailed_data:
-                details = detailed_data['value']
-                location = details.get('obcinaNaziv', '').upper()
-                intervention_type = details.get('intervencijaVrstaNaziv', '')
-                dogodekNaziv = details.get('dogodekNaziv', '')
-
-                lat = details.get('wgsLat', None)
-                lon = details.get('wgsLon', None)
-                
-                # Determine the region from the coordinates
-                if lat and lon:
-                    region = get_region_from_coordinates(lat, lon)
-                    if region in topics:
-                        await post_incident_to_topic(context.bot, incident, topics[region])
-                        posted_anywhere = True
-                        logger.info(f"Posted incident ID {incident_id} to region topic: {region}")  # Log successful post
-                        await asyncio.sleep(3)
-
-                # Post to the topic based on the intervention type if it matches any known topics
-                if intervention_type in topics:
-                    await post_incident_to_topic(context.bot, incident, topics[intervention_type])
-                    posted_anywhere = True
-                    logger.info(f"Posted incident ID {incident_id} to intervention type topic: {intervention_type}")  # Log successful post
-                    await asyncio.sleep(1)
-
-                # Check for keyword matches in the dogodekNaziv and post to those topics
-                matched_topics = match_keywords_in_dogodek(dogodekNaziv)
-                for matched_topic in matched_topics:
-                    if matched_topic in topics:
-                        await post_incident_to_topic(context.bot, incident, topics[matched_topic])
-                        posted_anywhere = True
-                        logger.info(f"Posted incident ID {incident_id} to keyword topic: {matched_topic}")  # Log successful post
-                        await asyncio.sleep(1)
-
-            # # If posted anywhere, delete from the All topic to avoid duplication
-            # if posted_anywhere:
-            #     # Remove from All topic if necessary (Add logic to delete post from All topic if needed)
-            #     pass
-
-            # After posting, add the ID to the fetched_incidents set and save it
-            fetched_incidents.add(incident_id)
-            
-            # Immediately write the updated set to the JSON file after each new incident post
-            write_posted_incidents(posted_incidents_file, fetched_incidents)
-            logger.info(f"Incident ID {incident_id} written to {posted_incidents_file}.")
-        else:
-            logger.info(f"Incident ID {incident_id} is already posted. Skipping.")  # Log if the incident is already posted
+    # Incidents waiting to be posted; a large backlog switches to a degraded posting mode
+    backlog = sum(1 for incident in incidents if incident['id'] not in fetched_incidents)
+    backlog_incidents.set(backlog)
+    level = load_shedder.update(backlog)
+
+    # The feed lists the newest incidents first. Post them oldest first, so the first incident of an
+    # event is the one posted with a map and the later ones reply to it (newest first while shedding load)
+    if level == NORMAL:
+        incidents.reverse()
+
+    try:
+        # Loop through and post each incident
+        for incident in incidents:
+            incident_id = incident['id']
+            logger.debug("Checking incident ID: %s", incident_id)  # Log the incident being checked
+
+            if incident['id'] not in fetched_incidents:
+                logger.info("New incident found: ID %s. Posting...", incident_id)  # Log the new incident found
+                level = load_shedder.update(backlog)
+                started = time.monotonic()
+                with profiling.span('incident', id=incident_id, level=level):
+                    await post_new_incident(context.bot, incident, pending, level)
+                load_shedder.record(time.monotonic() - started, level)
+                backlog -= 1
+                backlog_incidents.set(backlog)
+
+                # After posting, add the ID to the fetched_incidents set and save it
+                fetched_incidents.add(incident_id)
+
+                # Immediately write the updated set to the JSON file after each new incident post
+                fence()
+                stored_ids = write_posted_incidents(posted_incidents_file, fetched_incidents)
+                if len(fetched_incidents) > MAX_STORED_REPORTS:
+                    # Forget the IDs the state file dropped too, so the set does not grow for ever
+                    fetched_incidents.intersection_update(stored_ids)
+                complete_deliveries(pending, incident_id)
+                logger.info("Incident ID %s written to %s.", incident_id, posted_incidents_file)
+            else:
+                logger.debug("Incident ID %s is already posted. Skipping.", incident_id)  # Log if the incident is already posted
+    except LeaseLost as e:
+        step_down(context, e)
+
+# Function to list the topics an incident belongs to, with the pause to keep after posting to each
+def get_incident_topics(details):
+    incident_topics = [("All", 0)]
+    intervention_type = details.get('intervencijaVrstaNaziv', '')
+    dogodekNaziv = details.get('dogodekNaziv', '')
+
+    lat = details.get('wgsLat', None)
+    lon = details.get('wgsLon', None)
+
+    # Determine the region from the coordinates
+    if lat and lon:
+        region = get_region_from_coordinates(lat, lon)
+        if region in topics:
+            incident_topics.append((region, 3))
+
+    # Post to the topic based on the intervention type if it matches any known topics
+    if intervention_type in topics:
+        incident_topics.append((intervention_type, 1))
+
+    # Check for keyword matches in the dogodekNaziv and post to those topics
+    for matched_topic in match_keywords_in_dogodek(dogodekNaziv):
+        if matched_topic in topics:
+            incident_topics.append((matched_topic, 1))
+    return incident_topics
+
+# Function to post one new incident to the All topic and every matching category topic
+async def post_new_incident(bot, incident, pending, level=NORMAL):
+    """
+    The first incident of an event is posted with a map. Later incidents of the same
+    event (see assign_incident_cluster) are posted as text replies to that post in every
+    topic where it already appeared, so a large event does not flood the group with maps.
+
+    The load shedding level drops maps from keyword topics (NO_KEYWORD_MAPS), drops all
+    maps (TEXT_ONLY) or posts only to the All topic (ALL_ONLY).
+    """
+    incident_id = incident['id']
+
+    # Get incident details once for the message, the map and the categorization
+    detailed_data = get_incident_details(incident['link_suffix'])
+    if not detailed_data or 'value' not in detailed_data:
+        return
+    details = detailed_data['value']
+
+    message = build_incident_message(incident, details)
+    lat = details.get('wgsLat', None)
+    lon = details.get('wgsLon', None)
+    cluster, is_head = assign_incident_cluster(incident_id, details)
+    map_file = None
+    posted = False  # True once a send got through
+
+    async def send(topic_name):
+        nonlocal map_file, posted
+        reply_to = cluster.messages.get(topic_name) if cluster else None
+        if reply_to is not None:
+            sent = await send_incident(bot, message, topics[topic_name], reply_to_message_id=reply_to)
+            posted = posted or sent is not None
+            return sent
+        with_map = level == NORMAL or (level == NO_KEYWORD_MAPS and topic_name not in keywords_map)
+        if lat and lon and with_map and map_file is None:
+            # Render the map once and reuse it for every topic
+            create_static_map_image(lat, lon)
+            map_file = 'incident_map.png'
+        sent = await send_incident(bot, message, topics[topic_name], map_file=map_file if with_map else None)
+        if sent is not None:
+            posted = True
+            if cluster:
+                cluster.messages.setdefault(topic_name, sent.message_id)
+        return sent
+
+    if cluster and not is_head:
+        logger.info("Incident ID %s belongs to the event of incident ID %s. Replying in its threads.", incident_id, cluster.head_id)
+
+    incident_topics = [("All", 0)] if level >= ALL_ONLY else get_incident_topics(details)
+    for topic_name, pause in incident_topics:
+        if await deliver_once(pending, incident_id, topic_name, lambda: send(topic_name)):
+            logger.info("Posted incident ID %s to topic: %s", incident_id, topic_name)  # Log successful post
+            if pause:
+                await asyncio.sleep(pause)
+
+    # Count the incident only if it reached Telegram (sends give up after their retries)
+    if posted:
+        record_posted_incident(details.get('nastanekCas'))
+
+# Function to put an incident into the cluster of incidents describing the same event
+def assign_incident_cluster(incident_id, details):
+    """
+    Returns (cluster, is_head), or (None, True) when clustering is disabled or the
+    incident has no coordinates or time.
+    """
+    if incident_clusters is None:
+        return None, True
+    lat = details.get('wgsLat', None)
+    lon = details.get('wgsLon', None)
+    try:
+        when = datetime.strptime(details.get('nastanekCas', ''), '%Y-%m-%dT%H:%M:%S')
+        lat, lon = float(lat), float(lon)
+    except (TypeError, ValueError):
+        return None, True
+    return incident_clusters.assign(incident_id, lat, lon, when)
 
 # Function to read posted incidents from a JSON file
 def read_posted_incidents(file_path):
@@ -817,35 +1125,226 @@ def read_posted_incidents(file_path):
         return set()
 
 # Function to write posted incidents to a JSON file
+@timed_stage('write_state')
 def write_posted_incidents(file_path, incident_ids):
-    # Convert the set of incident IDs to a list and sort it
-    sorted_incident_ids = sorted(list(incident_ids))
+    # Convert the set of incident IDs to a list and sort it. The IDs are numeric strings; sorting by
+    # length first keeps numeric order when they gain a digit (9999999 < 10000000), so the newest
+    # IDs are the ones kept
+    sorted_incident_ids = sorted(incident_ids, key=lambda incident_id: (len(incident_id), incident_id))
 
     # Keep only the most recent MAX_STORED_REPORTS incidents
     if len(sorted_incident_ids) > MAX_STORED_REPORTS:
         sorted_incident_ids = sorted_incident_ids[-MAX_STORED_REPORTS:]
 
     # Write the limited list of IDs back to the JSON file
-    with open(file_path, 'w', encoding='utf-8') as file:
-        json.dump(sorted_incident_ids, file, ensure_ascii=False, indent=4)
+    write_json_atomic(file_path, sorted_incident_ids)
+    return sorted_incident_ids
+
+# Function to write JSON state atomically, so a crash or a takeover never leaves a truncated file behind
+def write_json_atomic(file_path, data):
+    tmp_path = f"{file_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as file:
+        json.dump(data, file, ensure_ascii=False, indent=4)
+    os.replace(tmp_path, file_path)
+
+# START Multi-instance coordination
+
+# Function to read the journal of topics already delivered for unfinished incidents
+def read_pending_deliveries(file_path):
+    try:
+        with open(file_path, 'r', encoding='utf-8') as file:
+            return {key: set(delivered) for key, delivered in json.load(file).items()}
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+# Function to get the delivery journal both jobs share, read from its file once per leadership term
+def get_pending_deliveries():
+    global pending_deliveries
+    if pending_deliveries is None:
+        pending_deliveries = read_pending_deliveries(pending_deliveries_file)
+    return pending_deliveries
+
+# Function to write the delivery journal
+def write_pending_deliveries(file_path, pending):
+    write_json_atomic(file_path, {key: sorted(delivered) for key, delivered in pending.items()})
+
+# Function to drop a fully posted incident from the delivery journal
+def complete_deliveries(pending, incident_key):
+    if pending.pop(incident_key, None) is not None:
+        fence()
+        write_pending_deliveries(pending_deliveries_file, pending)
+
+# Function to send to one topic at most once, even across restarts and leader failovers
+async def deliver_once(pending, incident_key, topic_name, send):
+    """
+    Await send() unless the journal shows topic_name was already delivered for incident_key,
+    then record the delivery. Returns True if something was sent.
+    """
+    delivered = pending.setdefault(incident_key, set())
+    if topic_name in delivered:
+        logger.info("%s was already delivered to %s. Skipping.", incident_key, topic_name)
+        return False
+    fence()
+    with profiling.span('send', topic=topic_name):
+        await send()
+    delivered.add(topic_name)
+    try:
+        fence()
+    except LeaseLost:
+        # The send went out before the lease was lost; journal it so the new leader skips it
+        journal_delivery(incident_key, topic_name)
+        raise
+    write_pending_deliveries(pending_deliveries_file, pending)
+    return True
+
+# Function to add one delivery to the journal file, keeping what the current leader has written to it
+def journal_delivery(incident_key, topic_name):
+    journal = read_pending_deliveries(pending_deliveries_file)
+    journal.setdefault(incident_key, set()).add(topic_name)
+    write_pending_deliveries(pending_deliveries_file, journal)
+
+# Function to stop acting as soon as another instance has taken over the leader lease
+def fence():
+    if leader_lease is not None:
+        leader_lease.fence()
+
+# Function to check (and renew when due) the leader lease at the start of a job
+def have_leadership(context):
+    if leader_lease is None:
+        return True
+    if leader_lease.ensure():
+        return True
+    step_down(context, "lease expired")
+    return False
+
+# Function to stop this instance's application after it lost the leader lease
+def step_down(context, reason):
+    global lost_leadership
+    if not lost_leadership:
+        logger.critical("Lost the leader lease (%s). Switching to standby.", reason)
+        lost_leadership = True
+        context.application.stop_running()
+
+# Job to keep the leader lease alive between fetch runs
+async def renew_leader_lease(context: CallbackContext):
+    have_leadership(context)
+
+# END Multi-instance coordination
+
+# Admin-only command: /profile [runs] [rss|vecji] arms profiling for the next runs of the jobs
+async def profile_command(update: Update, context: CallbackContext):
+    runs = PROFILE_RUNS
+    jobs = tuple(profiled_jobs.values())
+    for arg in context.args:
+        if arg.isdigit() and int(arg) > 0:
+            runs = int(arg)
+        elif arg in profiled_jobs:
+            jobs = (profiled_jobs[arg],)
+        else:
+            await update.effective_message.reply_text("Usage: /profile [runs] [rss|vecji]")
+            return
+    profiler.arm(runs, jobs)
+    await update.effective_message.reply_text(f"Profiling the next {runs} run(s) of {', '.join(jobs)}. Files go to {PROFILE_DIR}.")
+
+# kill -USR1 <pid> arms profiling of both jobs. Registered on the event loop, so the arming
+# runs as a loop callback between jobs rather than inside a signal handler interrupting one
+async def arm_profiling_on_signal(application: Application):
+    if hasattr(signal, 'SIGUSR1'):  # Not available on Windows
+        asyncio.get_running_loop().add_signal_handler(
+            signal.SIGUSR1, profiler.arm, PROFILE_RUNS, tuple(profiled_jobs.values()))
+
+# START Memory report
+
+# Memory per subsystem, attributed by where it was allocated (see memory_report.py)
+memory_reporter = memory_report.MemoryReporter([
+    ('geodata', ['geodata', 'shapely']),
+    ('history', [read_posted_incidents, write_posted_incidents, read_posted_vecji_obseg, write_posted_vecji_obseg,
+                 vecji_obseg_fingerprint, read_pending_deliveries, write_pending_deliveries, deliver_once,
+                 journal_delivery]),
+    ('clusters', ['incident_clusters']),
+    ('feeds', [get_rss_feed, parse_rss_feed, get_incident_details, get_vecji_obseg_data, 'requests', 'urllib3', 'xml']),
+    ('maps', [create_static_map_image, create_static_map_with_polygon, save_desaturated_map, 'staticmap', 'PIL']),
+    ('telegram', ['telegram', 'httpx', 'httpcore', 'h11', 'anyio', 'ssl']),
+    ('instrumentation', ['metrics', 'profiling', 'memory_report', 'logging_setup', 'logging']),
+], budget=int(MEMORY_BUDGET_MB * memory_report.MB) or None, budgets=MEMORY_BUDGETS)
+
+# Function to take a memory report off the event loop and publish it on /metrics
+async def take_memory_report():
+    report = await asyncio.to_thread(memory_reporter.report)
+    for subsystem, size in report.subsystems.items():
+        if size is not None:
+            memory_traced.labels(subsystem=subsystem).set(size)
+    return report
+
+# Job logging the memory report, as a warning when something is over its budget
+async def log_memory_report(context: CallbackContext):
+    report = await take_memory_report()
+    over_budget = report.over_budget()
+    if over_budget:
+        logger.warning("Memory over budget (%s):\n%s", ', '.join(over_budget), report)
+    else:
+        logger.info("Memory report:\n%s", report)
+
+# Admin-only command: /memory replies with the memory report
+async def memory_command(update: Update, context: CallbackContext):
+    report = await take_memory_report()
+    await update.effective_message.reply_text(f"<pre>{report}</pre>", parse_mode='HTML')
+
+# END Memory report
 
 async def error_handler(update: Update, context: CallbackContext):
-    logger.error(f"An error occurred: {context.error}")
+    logger.error("An error occurred: %s", context.error)
     
 # Main function to start the bot
 def main():
-    application = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
-    job_queue = application.job_queue
-    
-    
-    # Run fetching and posting for regular incidents and vecjiObseg incidents
-    job_queue.run_repeating(auto_fetch_and_post, interval=80, first=0)
-    job_queue.run_repeating(fetch_and_post_vecji_obseg, interval=80, first=60)  # Run vecjiObseg fetch every 150 seconds, offset by 60 seconds
-    
-    application.add_error_handler(error_handler)
+    global lost_leadership, pending_deliveries
+
+    if METRICS_PORT:
+        metrics.start_metrics_server(int(METRICS_PORT), METRICS_HOST)
+    if hasattr(signal, 'SIGUSR1'):
+        # Until the event loop takes it over, so that it does not kill a standby instance
+        signal.signal(signal.SIGUSR1, signal.SIG_IGN)
+
+    while True:
+        if leader_lease is not None:
+            # Standby: wait until the active instance stops renewing its lease
+            logger.warning("Waiting for the leader lease %s as %s...", LEASE_FILE, leader_lease.owner)
+            leader_lease.wait_for_leadership()
+            logger.warning("Leader lease acquired with fencing token %s.", leader_lease.token)
+            # Reload the state the previous leader wrote
+            fetched_incidents.clear()
+            pending_deliveries = None
+        lost_leadership = False
+
+        builder = Application.builder().token(TELEGRAM_BOT_TOKEN).post_init(arm_profiling_on_signal)
+        if TELEGRAM_API_URL:
+            builder = builder.base_url(f"{TELEGRAM_API_URL}/bot").base_file_url(f"{TELEGRAM_API_URL}/file/bot")
+        application = builder.build()
+        job_queue = application.job_queue
+        
+        
+        # Run fetching and posting for regular incidents and vecjiObseg incidents
+        job_queue.run_repeating(auto_fetch_and_post, interval=80, first=0)
+        job_queue.run_repeating(fetch_and_post_vecji_obseg, interval=80, first=60)  # Run vecjiObseg fetch every 150 seconds, offset by 60 seconds
+        if leader_lease is not None:
+            job_queue.run_repeating(renew_leader_lease, interval=LEASE_HEARTBEAT, first=LEASE_HEARTBEAT)
+        if MEMORY_REPORT_INTERVAL > 0:
+            job_queue.run_repeating(log_memory_report, interval=MEMORY_REPORT_INTERVAL, first=MEMORY_REPORT_INTERVAL)
+        
+        if ADMIN_IDS:
+            application.add_handler(CommandHandler('profile', profile_command, filters=filters.User(user_id=ADMIN_IDS)))
+            application.add_handler(CommandHandler('memory', memory_command, filters=filters.User(user_id=ADMIN_IDS)))
+        application.add_error_handler(error_handler)
+
+        application.run_polling(close_loop=False)
+        logger.info("Bot started and will automatically fetch and post new incidents every 2 minutes...")
+
+        # Go back to standby after losing the lease, otherwise this was a normal shutdown
+        if not lost_leadership:
+            break
 
-    application.run_polling()
-    logger.info("Bot started and will automatically fetch and post new incidents every 2 minutes...")
+    if leader_lease is not None:
+        leader_lease.release()
 
 if __name__ == "__main__":
     main()
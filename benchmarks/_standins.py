@@ -0,0 +1,90 @@
+"""
+Helpers shared by the benchmark and load-test harnesses: a local map tile server and
+importing SPIN112 configured for the fixtures and the local stand-ins.
+"""
+import os
+import sys
+import time
+import threading
+from io import BytesIO
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+FIXTURES_DIR = os.path.join(BENCH_DIR, 'fixtures')
+BOT_TOKEN = '123456:standin'
+GROUP_ID = '-1000000000000'
+
+
+def serve(handler):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def make_tile_handler(latency=0.0):
+    # Every tile request gets the same 256x256 PNG
+    from PIL import Image
+
+    buffer = BytesIO()
+    Image.new('RGB', (256, 256), (170, 211, 223)).save(buffer, format='PNG')
+    tile = buffer.getvalue()
+
+    class TileHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep(latency)
+            self.send_response(200)
+            self.send_header('Content-Type', 'image/png')
+            self.send_header('Content-Length', str(len(tile)))
+            self.end_headers()
+            self.wfile.write(tile)
+
+        def log_message(self, format, *args):
+            pass
+
+    return TileHandler
+
+
+def start_tile_stub(latency=0.0):
+    """
+    Serve map tiles locally; returns the server (its tile URL is tile_url(server)).
+    """
+    return serve(make_tile_handler(latency))
+
+
+def tile_url(server):
+    return f"http://127.0.0.1:{server.server_port}/{{z}}/{{x}}/{{y}}.png"
+
+
+def bot_environment(workdir, tile_url, spin3_url=None, telegram_api_url=None):
+    """
+    Environment variables running SPIN112 against the fixtures: dummy Telegram
+    credentials, fixture OB.geojson, state files in workdir and the given stand-ins.
+    """
+    environment = {
+        'TELEGRAM_BOT_TOKEN': BOT_TOKEN,
+        'TELEGRAM_GROUP_ID': GROUP_ID,
+        'SPIN112_SR_GEOJSON': os.path.join(REPO_DIR, 'SR.geojson'),
+        'SPIN112_OB_GEOJSON': os.path.join(FIXTURES_DIR, 'OB.geojson'),
+        'SPIN112_STATE_DIR': workdir,
+        'SPIN112_TILE_URL': tile_url,
+    }
+    if spin3_url:
+        environment['SPIN112_SPIN3_URL'] = spin3_url
+    if telegram_api_url:
+        environment['SPIN112_TELEGRAM_API_URL'] = telegram_api_url
+    return environment
+
+
+def import_bot(workdir, tile_url, spin3_url=None):
+    """
+    Import SPIN112 in this process configured by bot_environment, as a single instance,
+    with workdir as the working directory (maps and the log file are written there).
+    """
+    os.environ.update(bot_environment(workdir, tile_url, spin3_url))
+    os.environ.pop('SPIN112_LEASE_FILE', None)
+    os.chdir(workdir)
+    sys.path.insert(0, REPO_DIR)
+    import SPIN112
+    return SPIN112
@@ -0,0 +1,219 @@
+"""
+Microbenchmarks for the hot functions of SPIN112.py.
+
+Runs against the recorded fixtures in benchmarks/fixtures (SPIN3 RSS feed, incident
+details, vecjiObseg data and a small OB.geojson) plus the real SR.geojson, and renders
+maps from a local tile stub, so no network access is needed.
+
+    python benchmarks/bench_spin112.py                              # run and save results
+    python benchmarks/bench_spin112.py --output new.json --compare baseline.json
+    python benchmarks/bench_spin112.py --only region --only render  # name filters
+
+With --compare the exit code is 1 when any benchmark's median got slower than the
+baseline by more than --threshold (default 20 %).
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import statistics
+import subprocess
+import tempfile
+
+from _standins import BENCH_DIR, REPO_DIR, FIXTURES_DIR, start_tile_stub, tile_url, import_bot
+
+DEFAULT_OUTPUT = os.path.join(BENCH_DIR, 'last_run.json')
+
+# Registered benchmarks: name -> function returning the zero-argument callable to time
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return register
+
+
+def load_fixture(name, mode='r'):
+    with open(os.path.join(FIXTURES_DIR, name), mode, **({} if 'b' in mode else {'encoding': 'utf-8'})) as file:
+        return file.read()
+
+
+def define_benchmarks(bot, workdir):
+    rss_content = load_fixture('ODRSS.xml', 'rb')
+    details = [entry['value'] for entry in json.loads(load_fixture('lokacija.json')).values()]
+    vecji_obseg = json.loads(load_fixture('vecjiObseg.json'))['value']
+    points = [(d['wgsLat'], d['wgsLon']) for d in details]
+    names = [incident['obcinaNaziv'] for incident in vecji_obseg]
+
+    @benchmark('parse_rss_feed')
+    def _():
+        return lambda: bot.parse_rss_feed(rss_content)
+
+    @benchmark('get_region_from_coordinates')
+    def _():
+        # One call per fixture incident location
+        return lambda: [bot.get_region_from_coordinates(lat, lon) for lat, lon in points]
+
+    @benchmark('get_ob_region_and_centroid')
+    def _():
+        return lambda: [bot.get_ob_region_and_centroid(name) for name in names]
+
+    @benchmark('get_emojis_for_keywords')
+    def _():
+        return lambda: [bot.get_emojis_for_keywords(d['dogodekNaziv'], d['besedilo'], d['intervencijaVrstaNaziv'])
+                        for d in details]
+
+    @benchmark('match_keywords_in_dogodek')
+    def _():
+        return lambda: [bot.match_keywords_in_dogodek(d['dogodekNaziv']) for d in details]
+
+    @benchmark('is_duplicate_incident')
+    def _():
+        # Worst case: a new incident checked against a full history of MAX_STORED_REPORTS
+        history = [dict(vecji_obseg[i % len(vecji_obseg)], obcinaNaziv=f"Občina {i}")
+                   for i in range(bot.MAX_STORED_REPORTS)]
+        return lambda: bot.is_duplicate_incident(vecji_obseg[0], history)
+
+    @benchmark('write_posted_incidents')
+    def _():
+        incident_ids = {str(1200000 + i) for i in range(bot.MAX_STORED_REPORTS + 200)}
+        path = os.path.join(workdir, 'bench_posted_incidents.json')
+        return lambda: bot.write_posted_incidents(path, incident_ids)
+
+    @benchmark('create_static_map_image')
+    def _():
+        lat, lon = points[0]
+        path = os.path.join(workdir, 'bench_incident_map.png')
+        return lambda: bot.create_static_map_image(lat, lon, filename=path)
+
+    @benchmark('create_static_map_with_polygon')
+    def _():
+        polygon, _centroid = bot.get_ob_region_and_centroid(names[0])
+        path = os.path.join(workdir, 'bench_obcina_map.png')
+        return lambda: bot.create_static_map_with_polygon(polygon, filename=path)
+
+
+def measure(func, min_time, rounds):
+    """
+    Time func: calibrate the number of calls per round so a round takes at least
+    min_time seconds, then run the rounds and return per-call statistics in seconds.
+    """
+    func()  # warm up
+    number = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_time or number >= 1_000_000:
+            break
+        number *= 10 if elapsed < min_time / 10 else 2
+
+    samples = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        for _ in range(number):
+            func()
+        samples.append((time.perf_counter() - started) / number)
+    return {
+        'median': statistics.median(samples),
+        'min': min(samples),
+        'mean': statistics.fmean(samples),
+        'stdev': statistics.stdev(samples) if len(samples) > 1 else 0.0,
+        'rounds': rounds,
+        'number': number,
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, threshold):
+    """
+    Print the change of every benchmark's median against the baseline.
+    Returns the names that regressed by more than threshold.
+    """
+    regressions = []
+    print(f"\n{'benchmark':<34}{'baseline':>12}{'current':>12}{'change':>10}")
+    for name, stats in results.items():
+        base = baseline.get('results', {}).get(name)
+        if base is None:
+            print(f"{name:<34}{'-':>12}{format_seconds(stats['median']):>12}{'new':>10}")
+            continue
+        ratio = stats['median'] / base['median'] if base['median'] else float('inf')
+        flag = ''
+        if ratio > 1 + threshold:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print(f"{name:<34}{format_seconds(base['median']):>12}{format_seconds(stats['median']):>12}"
+              f"{(ratio - 1) * 100:>+9.1f}%{flag}")
+    return regressions
+
+
+def format_seconds(seconds):
+    for unit, scale in (('s', 1), ('ms', 1e-3), ('us', 1e-6)):
+        if seconds >= scale:
+            return f"{seconds / scale:.2f} {unit}"
+    return f"{seconds / 1e-9:.0f} ns"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SPIN112 microbenchmarks")
+    parser.add_argument('--output', default=DEFAULT_OUTPUT, help="where to save the JSON results")
+    parser.add_argument('--compare', metavar='BASELINE', help="JSON results of an earlier run to compare with")
+    parser.add_argument('--threshold', type=float, default=0.20, help="allowed slowdown of the median (0.20 = 20%%)")
+    parser.add_argument('--rounds', type=int, default=7)
+    parser.add_argument('--min-time', type=float, default=0.2, help="minimum seconds per round")
+    parser.add_argument('--only', action='append', default=[], help="run benchmarks whose name contains this")
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output)
+    baseline_path = os.path.abspath(args.compare) if args.compare else None
+    tile_server = start_tile_stub()
+    workdir = tempfile.mkdtemp(prefix='spin112-bench-')
+    bot = import_bot(workdir, tile_url(tile_server))
+    define_benchmarks(bot, workdir)
+
+    results = {}
+    for name, setup in BENCHMARKS.items():
+        if args.only and not any(pattern in name for pattern in args.only):
+            continue
+        stats = measure(setup(), args.min_time, args.rounds)
+        results[name] = stats
+        print(f"{name:<34}{format_seconds(stats['median']):>12}  (min {format_seconds(stats['min'])}, "
+              f"{stats['rounds']}x{stats['number']})", flush=True)
+    tile_server.shutdown()
+
+    report = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'git_revision': git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+        },
+        'results': results,
+    }
+    with open(output, 'w', encoding='utf-8') as file:
+        json.dump(report, file, indent=2)
+    print(f"\nResults saved to {output}")
+
+    if baseline_path:
+        with open(baseline_path, 'r', encoding='utf-8') as file:
+            baseline = json.load(file)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} benchmark(s) regressed by more than {args.threshold:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+"""
+Two-process check that a standby resumes a half-posted incident without double-posting.
+
+Starts the load-test stand-ins for SPIN3, the tile server and the Telegram Bot API, then
+two instances of the bot in separate processes sharing one lease file and one state
+directory (so one pending_deliveries.json journal). Instance A takes the lease and starts
+posting; it is killed with SIGKILL in the pause after a post, part way through an
+incident's topics. Instance B, waiting as a standby, takes over once the lease expires and
+has to finish that incident from the journal.
+
+With --stall, A is frozen (SIGSTOP) instead while it renders the map of its next incident,
+after its last lease check before sending. Once B has taken over and posted everything, A
+is resumed and must step down without sending anything.
+
+    python benchmarks/failover_check.py
+    python benchmarks/failover_check.py --incidents 5 --kill-after 4
+    python benchmarks/failover_check.py --stall
+
+Exits with code 1 if any incident was posted to a topic twice, an incident was not
+delivered, no incident was actually split between the two instances (without --stall),
+or A sent anything after it was resumed (with --stall).
+"""
+import os
+import sys
+import json
+import time
+import random
+import signal
+import asyncio
+import argparse
+import subprocess
+import tempfile
+from types import SimpleNamespace
+
+from _standins import REPO_DIR, BOT_TOKEN, serve, make_tile_handler, tile_url, bot_environment
+from loadtest import StandIn, make_spin3_handler, make_telegram_handler, synthetic_incidents
+
+
+async def run_instance():
+    """
+    One bot instance (run in a child process): wait for the lease as a standby, then post
+    like main() does, running the RSS job directly instead of through the job queue.
+    """
+    sys.path.insert(0, REPO_DIR)
+    import SPIN112
+    from telegram import Bot
+
+    bot = Bot(BOT_TOKEN, base_url=f"{os.environ['SPIN112_TELEGRAM_API_URL']}/bot")
+    await bot.initialize()
+    lease = SPIN112.leader_lease
+    print(f"{lease.owner}: standby", flush=True)
+    await asyncio.to_thread(lease.wait_for_leadership)
+    print(f"{lease.owner}: leader with fencing token {lease.token}", flush=True)
+
+    context = SimpleNamespace(bot=bot, application=SimpleNamespace(stop_running=lambda: None))
+
+    async def heartbeat():
+        while True:
+            await SPIN112.renew_leader_lease(context)
+            await asyncio.sleep(lease.heartbeat)
+
+    renewing = asyncio.create_task(heartbeat())
+    while not SPIN112.lost_leadership:
+        await SPIN112.auto_fetch_and_post(context)
+        await asyncio.sleep(1)
+    renewing.cancel()
+    print(f"{lease.owner}: lost the lease", flush=True)
+
+
+def start_instance(name, environment, workdir):
+    output = open(os.path.join(workdir, f"instance-{name}.out"), 'w')
+    return subprocess.Popen([sys.executable, os.path.abspath(__file__), '--instance'],
+                            env=dict(environment, SPIN112_LOG_FILE=os.path.join(workdir, f"instance-{name}.log")),
+                            cwd=workdir, stdout=output, stderr=subprocess.STDOUT)
+
+
+def delivered(stand_in):
+    # (time, topic thread, incident ID) of every accepted send
+    with stand_in.lock:
+        return [(at, thread_id, incident_id) for at, _method, thread_id, incident_id, status in stand_in.calls
+                if status == 200]
+
+
+def wait_for(condition, timeout, what):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return
+        time.sleep(0.1)
+    raise TimeoutError(f"Timed out after {timeout:.0f} s waiting for {what}")
+
+
+def posted_ids(workdir):
+    try:
+        with open(os.path.join(workdir, 'posted_incidents.json'), 'r', encoding='utf-8') as file:
+            return set(json.load(file))
+    except (FileNotFoundError, json.JSONDecodeError):
+        return set()
+
+
+def check(args):
+    stand_in = StandIn(SimpleNamespace(seed=args.seed, feed_size=1000, spin3_latency=0.0, tg_latency=0.0,
+                                       tg_max_rps=0, tg_429_rate=0.0, tg_retry_after=1))
+    spin3 = serve(make_spin3_handler(stand_in))
+    tile_requests = []  # times of tile requests, to catch A while it renders a map
+
+    class TileHandler(make_tile_handler(args.tile_latency)):
+        def do_GET(self):
+            tile_requests.append(time.monotonic())
+            super().do_GET()
+
+    tiles = serve(TileHandler)
+    telegram = serve(make_telegram_handler(stand_in))
+
+    workdir = tempfile.mkdtemp(prefix='spin112-failover-')
+    incidents = synthetic_incidents(args.incidents, 9100000, random.Random(args.seed))
+    incident_ids = {incident['id'] for incident in incidents}
+    stand_in.inject(incidents)
+
+    environment = dict(os.environ, **bot_environment(workdir, tile_url(tiles), f"http://127.0.0.1:{spin3.server_port}",
+                                                      f"http://127.0.0.1:{telegram.server_port}"))
+    environment.update({
+        'SPIN112_LEASE_FILE': os.path.join(workdir, 'spin112.lease'),
+        'SPIN112_LEASE_TTL': str(args.ttl),
+        'SPIN112_LEASE_HEARTBEAT': str(args.heartbeat),
+        'SPIN112_CLUSTER_RADIUS_M': '0',  # every incident is posted in full, no replies
+        'SPIN112_LOG_LEVEL': 'WARNING',
+    })
+
+    instances = {}
+    try:
+        instances['A'] = start_instance('A', environment, workdir)
+        wait_for(lambda: delivered(stand_in), args.timeout, "instance A to post")
+        instances['B'] = start_instance('B', environment, workdir)
+
+        if args.stall:
+            # Freeze A while it renders a map, i.e. after its lease check in deliver_once
+            def rendering_after_enough_posts():
+                sends = delivered(stand_in)
+                return len(sends) >= args.kill_after and tile_requests and tile_requests[-1] > sends[-1][0]
+
+            wait_for(rendering_after_enough_posts, args.timeout, f"instance A to render after {args.kill_after} posts")
+            instances['A'].send_signal(signal.SIGSTOP)
+        else:
+            # Kill A in the pause after a post, once its sends are journalled
+            def quiet_after_enough_posts():
+                sends = delivered(stand_in)
+                return len(sends) >= args.kill_after and time.monotonic() - sends[-1][0] >= 0.5
+
+            wait_for(quiet_after_enough_posts, args.timeout, f"{args.kill_after} posts by instance A")
+            instances['A'].kill()
+            instances['A'].wait()
+        killed_at = time.monotonic()
+        with open(os.path.join(workdir, 'pending_deliveries.json'), 'r', encoding='utf-8') as file:
+            journal = json.load(file)
+        print(f"{'Froze' if args.stall else 'Killed'} instance A after {len(delivered(stand_in))} posts; journal: {journal}")
+
+        wait_for(lambda: incident_ids <= posted_ids(workdir), args.timeout, "instance B to post every incident")
+        if args.stall:
+            resumed_at = time.monotonic()
+            instances['A'].send_signal(signal.SIGCONT)
+            instances['A'].wait(args.timeout)
+    except (TimeoutError, subprocess.TimeoutExpired) as e:
+        print(e)
+        for name in instances:
+            with open(os.path.join(workdir, f"instance-{name}.out"), 'r', encoding='utf-8') as file:
+                print(f"--- instance {name} output ---\n{file.read()}")
+        return False
+    finally:
+        for process in instances.values():
+            if process.poll() is None:
+                process.send_signal(signal.SIGCONT)
+                process.terminate()
+                process.wait()
+        for server in (spin3, tiles, telegram):
+            server.shutdown()
+
+    sends = [(at, thread_id, incident_id) for at, thread_id, incident_id in delivered(stand_in) if incident_id in incident_ids]
+    # Sends after A was resumed can only be A's, as B has posted every incident by then
+    late = [(thread_id, incident_id) for at, thread_id, incident_id in sends if args.stall and at >= resumed_at]
+    by_topic = {}
+    for at, thread_id, incident_id in sends:
+        sender = 'A' if at < killed_at or (args.stall and at >= resumed_at) else 'B'
+        by_topic.setdefault((incident_id, thread_id), []).append(sender)
+    duplicates = {key: senders for key, senders in by_topic.items() if len(senders) > 1}
+    split = sorted({incident_id for (incident_id, _thread), senders in by_topic.items() if senders == ['A']}
+                   & {incident_id for (incident_id, _thread), senders in by_topic.items() if senders == ['B']})
+    missing = sorted(incident_ids - {incident_id for incident_id, _thread in by_topic})
+
+    print(f"{len(sends)} posts for {len(incident_ids)} incidents, "
+          f"{sum(1 for senders in by_topic.values() if 'A' in senders)} by A, "
+          f"{sum(1 for senders in by_topic.values() if 'B' in senders)} by B")
+    for incident_id in split:
+        counts = {sender: sum(1 for (i, _thread), senders in by_topic.items() if i == incident_id and sender in senders)
+                  for sender in 'AB'}
+        print(f"Incident {incident_id} resumed by B: A posted it to {counts['A']} topic(s) "
+              f"({', '.join(journal.get(incident_id, []))} in the journal), B to the other {counts['B']}")
+    for (incident_id, thread_id), senders in duplicates.items():
+        print(f"DUPLICATE: incident {incident_id} posted to thread {thread_id} by {' and '.join(senders)}")
+    for thread_id, incident_id in late:
+        print(f"LATE SEND: incident {incident_id} posted to thread {thread_id} by A after it lost the lease")
+    if missing:
+        print(f"MISSING: {', '.join(missing)}")
+    if not split and not args.stall:
+        print("No incident was split between A and B; try another --kill-after.")
+    ok = not duplicates and not missing and not late and (bool(split) or args.stall)
+    print("OK" if ok else "FAILED")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SPIN112 two-process failover check")
+    parser.add_argument('--incidents', type=int, default=3, help="synthetic incidents to post")
+    parser.add_argument('--kill-after', type=int, default=2, help="posts by instance A before it is killed")
+    parser.add_argument('--ttl', type=float, default=4.0, help="leader lease ttl in seconds")
+    parser.add_argument('--heartbeat', type=float, default=1.0, help="leader lease heartbeat in seconds")
+    parser.add_argument('--timeout', type=float, default=120.0, help="give up waiting after this many seconds")
+    parser.add_argument('--stall', action='store_true', help="freeze instance A while it renders instead of killing it")
+    parser.add_argument('--tile-latency', type=float, default=0.2, help="seconds per map tile request")
+    parser.add_argument('--seed', type=int, default=112)
+    parser.add_argument('--instance', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.instance:
+        asyncio.run(run_instance())
+        return
+    sys.exit(0 if check(args) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,375 @@
+"""
+End-to-end load test of auto_fetch_and_post against local stand-ins.
+
+Starts local HTTP servers in place of SPIN3 (ODRSS feed, lokacija/{id} details and
+vecjiObseg.json), the map tile server and the Telegram Bot API, injects bursts of
+synthetic incidents into the feed and runs the bot's jobs against them until every
+incident is posted. The Telegram stand-in adds latency, enforces a request rate and
+answers with 429 retry_after like the real API.
+
+    python benchmarks/loadtest.py --incidents 300
+    python benchmarks/loadtest.py --incidents 200 --bursts 3 --burst-gap 60 --tg-max-rps 20 --tg-429-rate 0.05
+
+Reports throughput, p50/p99 incident-to-delivery latency (from the moment an incident
+appears in the feed to its first and to its last Telegram post) and API calls per
+topic, and saves the report as JSON.
+"""
+import os
+import re
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import threading
+import statistics
+from types import SimpleNamespace
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+from email.parser import BytesParser
+from email.policy import default as email_policy
+from xml.sax.saxutils import escape
+from urllib.parse import parse_qs, urlsplit
+from http.server import BaseHTTPRequestHandler
+
+from _standins import BENCH_DIR, FIXTURES_DIR, BOT_TOKEN, GROUP_ID, serve, start_tile_stub, tile_url, import_bot
+
+DEFAULT_OUTPUT = os.path.join(BENCH_DIR, 'last_loadtest.json')
+
+# Incident ID as it appears in the link at the end of every incident post
+INCIDENT_ID_PATTERN = re.compile(r"zemljevid/(\d+)'")
+
+
+class StandIn:
+    """
+    Shared state of the stand-in servers: the synthetic feed and the recorded Telegram calls.
+    """
+
+    def __init__(self, args):
+        self.args = args
+        self.lock = threading.Lock()
+        self.feed = []  # newest first, like SPIN3
+        self.details = {}
+        self.injected_at = {}  # incident ID -> time.monotonic() it appeared in the feed
+        self.calls = []  # (time, method, thread_id, incident_id, status)
+        self.message_id = 0
+        self.window_start = 0.0
+        self.window_calls = 0
+        self.random = random.Random(args.seed)
+        with open(os.path.join(FIXTURES_DIR, 'vecjiObseg.json'), 'rb') as file:
+            self.vecji_obseg = file.read()
+
+    def inject(self, incidents):
+        with self.lock:
+            now = time.monotonic()
+            for incident in incidents:
+                self.details[incident['id']] = incident['details']
+                self.injected_at[incident['id']] = now
+            self.feed = (list(reversed(incidents)) + self.feed)[:self.args.feed_size]
+
+    def rss(self):
+        with self.lock:
+            feed = list(self.feed)
+        items = ''.join(
+            f"<item><title>{escape(i['details']['dogodekNaziv'])}</title>"
+            f"<link>https://spin3.sos112.si/javno/zemljevid/{i['id']}</link>"
+            f"<description>{escape(i['details']['besedilo'])}</description>"
+            f"<pubDate>{i['pub_date']}</pubDate><guid isPermaLink=\"false\">{i['id']}</guid></item>"
+            for i in feed)
+        return (f'<?xml version="1.0" encoding="utf-8"?><rss version="2.0"><channel><title>SPIN3</title>'
+                f'{items}</channel></rss>').encode('utf-8')
+
+    def telegram_admit(self):
+        """
+        Decide whether a Bot API call is accepted; returns None or the retry_after to answer with.
+        """
+        with self.lock:
+            now = time.monotonic()
+            if now - self.window_start >= 1.0:
+                self.window_start, self.window_calls = now, 0
+            if self.args.tg_max_rps and self.window_calls >= self.args.tg_max_rps:
+                return max(1, round(1.0 - (now - self.window_start)))
+            if self.random.random() < self.args.tg_429_rate:
+                return self.args.tg_retry_after
+            self.window_calls += 1
+            return None
+
+    def record(self, method, thread_id, incident_id, status):
+        with self.lock:
+            self.calls.append((time.monotonic(), method, thread_id, incident_id, status))
+            self.message_id += 1
+            return self.message_id
+
+
+def make_spin3_handler(stand_in):
+    class Spin3Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep(stand_in.args.spin3_latency)
+            path = urlsplit(self.path).path
+            if path.startswith('/api/javno/ODRSS/'):
+                self.reply(stand_in.rss(), 'application/rss+xml')
+            elif path.startswith('/api/javno/lokacija/'):
+                details = stand_in.details.get(path.rsplit('/', 1)[-1])
+                if details is None:
+                    self.send_error(404)
+                    return
+                self.reply(json.dumps({'value': details}, ensure_ascii=False).encode('utf-8'), 'application/json')
+            elif path == '/javno/assets/data/vecjiObseg.json':
+                self.reply(stand_in.vecji_obseg, 'application/json')
+            else:
+                self.send_error(404)
+
+        def reply(self, body, content_type):
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Spin3Handler
+
+
+def parse_bot_api_request(content_type, body):
+    # python-telegram-bot sends form-encoded parameters, or multipart when uploading files
+    if content_type.startswith('multipart/form-data'):
+        message = BytesParser(policy=email_policy).parsebytes(
+            f"Content-Type: {content_type}\r\n\r\n".encode('latin-1') + body)
+        fields = {}
+        for part in message.iter_parts():
+            name = part.get_param('name', header='content-disposition')
+            if part.get_filename() is None:
+                fields[name] = part.get_content()
+        return fields
+    if content_type.startswith('application/json'):
+        return json.loads(body or b'{}')
+    return {key: values[0] for key, values in parse_qs(body.decode('utf-8')).items()}
+
+
+def make_telegram_handler(stand_in):
+    class TelegramHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            time.sleep(stand_in.args.tg_latency)
+            method = self.path.rsplit('/', 1)[-1]
+            fields = parse_bot_api_request(self.headers.get('Content-Type', ''), body)
+
+            if method == 'getMe':
+                self.reply({'ok': True, 'result': {'id': 123456, 'is_bot': True, 'first_name': 'SPIN112',
+                                                   'username': 'spin112_loadtest_bot'}})
+                return
+
+            text = fields.get('text') or fields.get('caption') or ''
+            match = INCIDENT_ID_PATTERN.search(text)
+            incident_id = match.group(1) if match else 'vecji'
+            thread_id = fields.get('message_thread_id')
+            thread_id = int(thread_id) if thread_id not in (None, '', 'null') else None
+
+            retry_after = stand_in.telegram_admit()
+            if retry_after is not None:
+                stand_in.record(method, thread_id, incident_id, 429)
+                self.reply({'ok': False, 'error_code': 429,
+                            'description': f"Too Many Requests: retry after {retry_after}",
+                            'parameters': {'retry_after': retry_after}}, status=429)
+                return
+
+            message_id = stand_in.record(method, thread_id, incident_id, 200)
+            result = {'message_id': message_id, 'date': int(time.time()),
+                      'chat': {'id': int(GROUP_ID), 'type': 'supergroup', 'title': 'SPIN loadtest'}}
+            if thread_id is not None:
+                result['message_thread_id'] = thread_id
+            if method == 'sendPhoto':
+                result['caption'] = text
+                result['photo'] = [{'file_id': f"photo{message_id}", 'file_unique_id': f"u{message_id}",
+                                    'width': 800, 'height': 600}]
+            else:
+                result['text'] = text
+            self.reply({'ok': True, 'result': result})
+
+        def reply(self, payload, status=200):
+            body = json.dumps(payload).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return TelegramHandler
+
+
+def synthetic_incidents(count, first_id, rng):
+    """
+    Build count incidents from the recorded details, with new IDs, jittered locations and
+    the current time, so they look like a fresh burst.
+    """
+    with open(os.path.join(FIXTURES_DIR, 'lokacija.json'), 'r', encoding='utf-8') as file:
+        templates = [entry['value'] for entry in json.load(file).values()]
+    now = datetime.now(ZoneInfo('Europe/Ljubljana'))  # SPIN3 times are Slovenian wall-clock time
+    incidents = []
+    for n in range(count):
+        template = rng.choice(templates)
+        incident_id = str(first_id + n)
+        details = dict(template, id=int(incident_id),
+                       wgsLat=round(template['wgsLat'] + rng.uniform(-0.05, 0.05), 6),
+                       wgsLon=round(template['wgsLon'] + rng.uniform(-0.05, 0.05), 6),
+                       nastanekCas=(now - timedelta(seconds=rng.randint(0, 600))).strftime('%Y-%m-%dT%H:%M:%S'))
+        incidents.append({'id': incident_id, 'details': details,
+                          'pub_date': now.strftime('%a, %d %b %Y %H:%M:%S GMT')})
+    return incidents
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(q / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def build_report(stand_in, bot_module, started, finished, injected):
+    topic_names = {topic_id: name for name, topic_id in bot_module.topics.items()}
+    first_delivery, last_delivery = {}, {}
+    per_topic = {}
+    status_counts = {}
+    for at, method, thread_id, incident_id, status in stand_in.calls:
+        topic = topic_names.get(thread_id, str(thread_id))
+        counts = per_topic.setdefault(topic, {'sendPhoto': 0, 'sendMessage': 0, '429': 0})
+        status_counts[status] = status_counts.get(status, 0) + 1
+        if status == 429:
+            counts['429'] += 1
+            continue
+        counts[method] = counts.get(method, 0) + 1
+        if incident_id in stand_in.injected_at:
+            first_delivery.setdefault(incident_id, at)
+            last_delivery[incident_id] = at
+
+    first_latencies = [first_delivery[i] - stand_in.injected_at[i] for i in first_delivery]
+    last_latencies = [last_delivery[i] - stand_in.injected_at[i] for i in last_delivery]
+    elapsed = finished - started
+    delivered = len(first_delivery)
+    api_calls = len(stand_in.calls)
+
+    def summary(latencies):
+        return {'p50': percentile(latencies, 50), 'p99': percentile(latencies, 99),
+                'max': max(latencies) if latencies else None,
+                'mean': statistics.fmean(latencies) if latencies else None}
+
+    return {
+        'incidents_injected': injected,
+        'incidents_delivered': delivered,
+        'elapsed_s': elapsed,
+        'throughput_incidents_per_s': delivered / elapsed if elapsed else None,
+        'api_calls': api_calls,
+        'api_calls_per_s': api_calls / elapsed if elapsed else None,
+        'api_status_counts': {str(status): count for status, count in status_counts.items()},
+        'latency_first_post_s': summary(first_latencies),
+        'latency_all_topics_s': summary(last_latencies),
+        'calls_per_topic': per_topic,
+    }
+
+
+def print_report(report):
+    def fmt(value):
+        return '-' if value is None else f"{value:.2f}"
+
+    print(f"\nDelivered {report['incidents_delivered']}/{report['incidents_injected']} incidents "
+          f"in {report['elapsed_s']:.1f} s ({fmt(report['throughput_incidents_per_s'])} incidents/s)")
+    print(f"Bot API calls: {report['api_calls']} ({fmt(report['api_calls_per_s'])}/s), "
+          f"by status: {report['api_status_counts']}")
+    for label, key in (('first post', 'latency_first_post_s'), ('all topics', 'latency_all_topics_s')):
+        latency = report[key]
+        print(f"Latency to {label:<10}  p50 {fmt(latency['p50'])} s  p99 {fmt(latency['p99'])} s  "
+              f"max {fmt(latency['max'])} s")
+    print(f"\n{'topic':<40}{'sendPhoto':>10}{'sendMessage':>12}{'429':>6}")
+    for topic, counts in sorted(report['calls_per_topic'].items(), key=lambda item: -sum(item[1].values())):
+        print(f"{topic:<40}{counts['sendPhoto']:>10}{counts['sendMessage']:>12}{counts['429']:>6}")
+
+
+async def run(args):
+    stand_in = StandIn(args)
+    spin3 = serve(make_spin3_handler(stand_in))
+    tiles = start_tile_stub(args.tile_latency)
+    telegram = serve(make_telegram_handler(stand_in))
+
+    workdir = tempfile.mkdtemp(prefix='spin112-loadtest-')
+    bot_module = import_bot(workdir, tile_url(tiles), f"http://127.0.0.1:{spin3.server_port}")
+    from telegram import Bot
+
+    bot = Bot(BOT_TOKEN, base_url=f"http://127.0.0.1:{telegram.server_port}/bot")
+    await bot.initialize()
+    context = SimpleNamespace(bot=bot, application=None)
+
+    rng = random.Random(args.seed)
+    per_burst = [args.incidents // args.bursts + (1 if n < args.incidents % args.bursts else 0)
+                 for n in range(args.bursts)]
+    next_id = 9000000
+
+    async def inject_bursts():
+        nonlocal next_id
+        for n, count in enumerate(per_burst):
+            if n:
+                await asyncio.sleep(args.burst_gap)
+            stand_in.inject(synthetic_incidents(count, next_id, rng))
+            print(f"Injected burst {n + 1}/{len(per_burst)} with {count} incidents", flush=True)
+            next_id += count
+
+    started = time.monotonic()
+    injector = asyncio.create_task(inject_bursts())
+    deadline = started + args.timeout
+    cycles = 0
+    while time.monotonic() < deadline:
+        await bot_module.auto_fetch_and_post(context)
+        if args.with_vecji_obseg:
+            await bot_module.fetch_and_post_vecji_obseg(context)
+        cycles += 1
+        if injector.done() and all(i in bot_module.fetched_incidents for i in stand_in.injected_at):
+            break
+        await asyncio.sleep(args.poll_interval)
+    finished = time.monotonic()
+    injector.cancel()
+    await bot.shutdown()
+    for server in (spin3, tiles, telegram):
+        server.shutdown()
+
+    report = build_report(stand_in, bot_module, started, finished, args.incidents)
+    report['poll_cycles'] = cycles
+    report['timed_out'] = finished >= deadline
+    report['settings'] = {key: value for key, value in vars(args).items() if key != 'output'}
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SPIN112 end-to-end load test")
+    parser.add_argument('--incidents', type=int, default=200, help="total synthetic incidents to inject")
+    parser.add_argument('--bursts', type=int, default=1, help="number of bursts the incidents are split into")
+    parser.add_argument('--burst-gap', type=float, default=30.0, help="seconds between bursts")
+    parser.add_argument('--feed-size', type=int, default=1000, help="incidents kept in the RSS feed")
+    parser.add_argument('--poll-interval', type=float, default=2.0, help="seconds between runs of the jobs")
+    parser.add_argument('--with-vecji-obseg', action='store_true', help="also run fetch_and_post_vecji_obseg")
+    parser.add_argument('--spin3-latency', type=float, default=0.05, help="seconds added to every SPIN3 request")
+    parser.add_argument('--tile-latency', type=float, default=0.02, help="seconds added to every tile request")
+    parser.add_argument('--tg-latency', type=float, default=0.05, help="seconds added to every Bot API request")
+    parser.add_argument('--tg-max-rps', type=int, default=30, help="Bot API requests per second before 429 (0 = no limit)")
+    parser.add_argument('--tg-429-rate', type=float, default=0.0, help="share of Bot API requests answered with 429")
+    parser.add_argument('--tg-retry-after', type=int, default=1, help="retry_after of the random 429 answers")
+    parser.add_argument('--timeout', type=float, default=1800.0, help="give up after this many seconds")
+    parser.add_argument('--seed', type=int, default=112)
+    parser.add_argument('--output', default=DEFAULT_OUTPUT, help="where to save the JSON report")
+    args = parser.parse_args()
+    args.output = os.path.abspath(args.output)
+
+    report = asyncio.run(run(args))
+    print_report(report)
+    with open(args.output, 'w', encoding='utf-8') as file:
+        json.dump(report, file, indent=2, ensure_ascii=False)
+    print(f"\nReport saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
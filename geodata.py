@@ -0,0 +1,131 @@
+import json
+from array import array
+import numpy as np
+from shapely.geometry import shape, Point, Polygon, MultiPolygon
+from shapely.prepared import prep
+
+# Nesting depth of the position lists in the GeoJSON coordinates of each geometry type
+_DEPTH = {'Point': 0, 'MultiPoint': 1, 'LineString': 1, 'Polygon': 2, 'MultiLineString': 2, 'MultiPolygon': 3}
+
+
+def _pack(coordinates, depth):
+    # Every list of positions becomes one flat array of lon, lat doubles (16 bytes per position
+    # instead of about 150 for a list of two Python floats); the outer nesting is kept in tuples
+    if depth == 0:
+        return array('d', coordinates[:2])
+    if depth == 1:
+        return array('d', [value for position in coordinates for value in position[:2]])
+    return tuple(_pack(part, depth - 1) for part in coordinates)
+
+
+def _unpack(packed, depth):
+    if depth == 0:
+        return list(packed)
+    if depth == 1:
+        return [[packed[i], packed[i + 1]] for i in range(0, len(packed), 2)]
+    return [_unpack(part, depth - 1) for part in packed]
+
+
+def _bounds(packed, depth):
+    # (minx, miny, maxx, maxy) of packed coordinates
+    if depth <= 1:
+        xs, ys = packed[0::2], packed[1::2]
+        return min(xs), min(ys), max(xs), max(ys)
+    parts = [_bounds(part, depth - 1) for part in packed if len(part)]
+    return (min(b[0] for b in parts), min(b[1] for b in parts),
+            max(b[2] for b in parts), max(b[3] for b in parts))
+
+
+def _polygon(rings):
+    # Shapely polygon straight from packed rings, without building lists of positions
+    shell, *holes = (np.frombuffer(ring, dtype=np.float64).reshape(-1, 2) for ring in rings)
+    return Polygon(shell, holes)
+
+
+class RegionIndex:
+    """
+    The named regions of a GeoJSON FeatureCollection, indexed for point-in-region lookups
+    and for looking up a region's geometry by name. Only the name property and the
+    geometry of each feature are kept; the rest of the parsed file can be freed.
+
+    The coordinates are kept as flat arrays of doubles (about a tenth of the memory of
+    the parsed GeoJSON), and geometry() rebuilds the GeoJSON dict on every call. By
+    default prepared shapely geometries of all regions are also built on the first
+    lookup and kept, which makes lookups fast. With compact=True a shapely geometry is
+    only built, and then dropped, for the regions whose bounding box contains the point
+    being looked up.
+    """
+
+    def __init__(self, features, name_property, compact=False):
+        self.compact = compact
+        self.names = []
+        self._types = []
+        self._geometries = []  # packed coordinates
+        self._bounds = []
+        self._by_name = {}
+        self._prepared = None  # prepared shapely geometries, unless compact
+        for feature in features:
+            geometry = feature.get('geometry')
+            if not geometry or geometry.get('type') not in _DEPTH or not geometry.get('coordinates'):
+                continue
+            geometry_type = geometry['type']
+            packed = _pack(geometry['coordinates'], _DEPTH[geometry_type])
+            name = feature['properties'][name_property]
+            self._by_name.setdefault(name.upper(), len(self.names))
+            self.names.append(name)
+            self._types.append(geometry_type)
+            self._geometries.append(packed)
+            self._bounds.append(_bounds(packed, _DEPTH[geometry_type]))
+
+    def __len__(self):
+        return len(self.names)
+
+    def geometry(self, name):
+        """
+        Return the GeoJSON geometry dict of the region with the given name
+        (case-insensitive), or None. It is rebuilt on every call.
+        """
+        index = self._by_name.get(name.upper())
+        if index is None:
+            return None
+        return self._geometry_at(index)
+
+    def _geometry_at(self, index):
+        geometry_type = self._types[index]
+        return {'type': geometry_type, 'coordinates': _unpack(self._geometries[index], _DEPTH[geometry_type])}
+
+    def _shape_at(self, index):
+        geometry_type = self._types[index]
+        if geometry_type == 'Polygon':
+            return _polygon(self._geometries[index])
+        if geometry_type == 'MultiPolygon':
+            return MultiPolygon([_polygon(rings) for rings in self._geometries[index]])
+        return shape(self._geometry_at(index))
+
+    def find(self, lon, lat):
+        """
+        Return the name of the first region (in file order) containing the point, or None.
+        """
+        point = None
+        for index, (minx, miny, maxx, maxy) in enumerate(self._bounds):
+            if not (minx <= lon <= maxx and miny <= lat <= maxy):
+                continue
+            if point is None:
+                point = Point(lon, lat)
+            if self.compact:
+                contains = self._shape_at(index).contains(point)
+            else:
+                if self._prepared is None:
+                    self._prepared = [prep(self._shape_at(i)) for i in range(len(self.names))]
+                contains = self._prepared[index].contains(point)
+            if contains:
+                return self.names[index]
+        return None
+
+
+def load_region_index(path, name_property, compact=False):
+    """
+    Build a RegionIndex from a GeoJSON file. The parsed file is not kept.
+    """
+    with open(path, 'r', encoding='utf-8') as file:
+        return RegionIndex(json.load(file)['features'], name_property, compact)
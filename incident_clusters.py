@@ -0,0 +1,126 @@
+import math
+from datetime import timedelta
+
+# Metres per degree of latitude (close enough everywhere for grid bucketing)
+METRES_PER_DEGREE = 111320.0
+# Northernmost latitude of Slovenia; longitude cells sized here are wide enough for the whole country
+REFERENCE_LATITUDE = 47.0
+
+
+# Great-circle distance between two WGS84 points in metres
+def haversine_m(lat1, lon1, lat2, lon2):
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * 6371000.0 * math.asin(math.sqrt(a))
+
+
+class IncidentCluster:
+    """
+    A group of incidents that describe the same event.
+
+    Attributes:
+        head_id (str): ID of the first incident, the one posted with a map.
+        lat, lon (float): Location of the head incident.
+        first_time, last_time (datetime): Earliest and latest nastanekCas of the members.
+        members (list): IDs of all incidents in the cluster, head first.
+        messages (dict): Topic name -> Telegram message_id of the post later members reply to.
+    """
+
+    def __init__(self, head_id, lat, lon, when):
+        self.head_id = head_id
+        self.lat = lat
+        self.lon = lon
+        self.first_time = when
+        self.last_time = when
+        self.members = [head_id]
+        self.messages = {}
+
+    def add(self, incident_id, when):
+        self.members.append(incident_id)
+        self.first_time = min(self.first_time, when)
+        self.last_time = max(self.last_time, when)
+
+
+class IncidentClusterIndex:
+    """
+    Grid index that finds the cluster an incident belongs to in O(1).
+
+    Space is cut into cells at least radius_m wide, so every cluster within radius_m of
+    a point is in that point's cell or one of its eight neighbours. An incident joins a
+    cluster when it is within radius_m of the cluster head and its time lies within
+    window of the cluster's time span.
+
+    Parameters:
+        radius_m (float): Maximum distance in metres between an incident and the cluster head.
+        window (timedelta): Maximum gap in time between an incident and the cluster.
+    """
+
+    def __init__(self, radius_m=300.0, window=timedelta(minutes=45)):
+        self.radius_m = radius_m
+        self.window = window
+        self.cell_lat = radius_m / METRES_PER_DEGREE
+        self.cell_lon = radius_m / (METRES_PER_DEGREE * math.cos(math.radians(REFERENCE_LATITUDE)))
+        self.cells = {}  # (row, col) -> list of clusters headed in that cell
+        self.by_incident = {}  # incident ID -> cluster
+        self.newest_time = None
+
+    def _cell(self, lat, lon):
+        return (math.floor(lat / self.cell_lat), math.floor(lon / self.cell_lon))
+
+    def find(self, lat, lon, when):
+        """
+        Return the closest cluster matching the location and time, or None.
+        """
+        row, col = self._cell(lat, lon)
+        best, best_distance = None, None
+        for d_row in (-1, 0, 1):
+            for d_col in (-1, 0, 1):
+                for cluster in self.cells.get((row + d_row, col + d_col), ()):
+                    if when < cluster.first_time - self.window or when > cluster.last_time + self.window:
+                        continue
+                    distance = haversine_m(lat, lon, cluster.lat, cluster.lon)
+                    if distance <= self.radius_m and (best is None or distance < best_distance):
+                        best, best_distance = cluster, distance
+        return best
+
+    def assign(self, incident_id, lat, lon, when):
+        """
+        Put an incident into its cluster, starting a new one if none matches.
+        Returns (cluster, is_head). Assigning the same ID twice returns the same cluster.
+        """
+        if incident_id in self.by_incident:
+            cluster = self.by_incident[incident_id]
+            return cluster, cluster.head_id == incident_id
+
+        cluster = self.find(lat, lon, when)
+        if cluster is None:
+            cluster = IncidentCluster(incident_id, lat, lon, when)
+            self.cells.setdefault(self._cell(lat, lon), []).append(cluster)
+            is_head = True
+        else:
+            cluster.add(incident_id, when)
+            is_head = False
+        self.by_incident[incident_id] = cluster
+
+        if self.newest_time is None or when > self.newest_time:
+            self.newest_time = when
+            self.expire(when - 2 * self.window)
+        return cluster, is_head
+
+    def expire(self, before):
+        """
+        Forget clusters whose latest incident happened before the given time.
+        """
+        for key in list(self.cells):
+            alive = [cluster for cluster in self.cells[key] if cluster.last_time >= before]
+            if alive:
+                self.cells[key] = alive
+            else:
+                del self.cells[key]
+        self.by_incident = {incident_id: cluster for incident_id, cluster in self.by_incident.items()
+                            if cluster.last_time >= before}
+
+    def __len__(self):
+        return sum(len(clusters) for clusters in self.cells.values())
@@ -0,0 +1,205 @@
+import os
+import json
+import time
+import socket
+import logging
+import argparse
+
+try:
+    import fcntl  # POSIX advisory locks guard the lease read-modify-write
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+# Raised when an instance tries to act after its lease has run out
+class LeaseLost(Exception):
+    pass
+
+
+class LeaderLease:
+    """
+    Active/standby coordination through a lease file on a local disk or shared volume.
+
+    The lease file holds the current owner, a fencing token and an expiry time. Every
+    change to it happens while holding an exclusive flock on a sibling ".lock" file, so
+    two processes can never both believe they acquired the same lease. The token grows
+    by one on every change of owner; a deposed leader sees its token is stale and stops.
+
+    Parameters:
+        path (str): Path of the lease file (the lock file is path + '.lock').
+        ttl (float): Seconds a lease stays valid without a heartbeat.
+        heartbeat (float): Seconds between renewals while leading.
+        owner (str): Identifier of this instance, defaults to host:pid.
+    """
+
+    def __init__(self, path, ttl=15.0, heartbeat=3.0, owner=None):
+        if fcntl is None:
+            raise RuntimeError("Leader lease requires POSIX file locks (fcntl).")
+        if heartbeat >= ttl:
+            raise ValueError("Lease heartbeat must be shorter than the lease ttl.")
+        self.path = path
+        self.lock_path = f"{path}.lock"
+        self.ttl = ttl
+        self.heartbeat = heartbeat
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}"
+        self.token = None
+        # Local deadlines use the monotonic clock so a hung process can tell that its
+        # lease ran out while it was frozen without trusting the lease file.
+        self._valid_until = 0.0
+        self._renew_after = 0.0
+
+    def _read(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as file:
+                return json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _write(self, lease):
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            json.dump(lease, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, self.path)
+
+    def _locked(self, update):
+        # Run update(lease) -> new lease or None while holding the lock file
+        with open(self.lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                lease = self._read()
+                new_lease = update(lease)
+                if new_lease is not None:
+                    self._write(new_lease)
+                return new_lease
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def _grant(self, token, started):
+        self.token = token
+        # Stay a little on the safe side of the expiry written to the file
+        self._valid_until = started + self.ttl - self.heartbeat
+        self._renew_after = started + self.heartbeat
+
+    def try_acquire(self):
+        """
+        Take the lease if it is free, expired or already ours. Returns True when leading.
+        """
+        started = time.monotonic()
+        now = time.time()
+
+        def update(lease):
+            owner = lease.get('owner')
+            token = int(lease.get('token', 0))
+            if owner and owner != self.owner and lease.get('expires_at', 0) > now:
+                return None  # Somebody else holds a live lease
+            if owner != self.owner or token != self.token:
+                token += 1  # New term: fence off whoever held it before
+            return {'owner': self.owner, 'token': token, 'expires_at': now + self.ttl, 'heartbeat_at': now}
+
+        lease = self._locked(update)
+        if lease is None:
+            self.token = None
+            return False
+        if lease['token'] != self.token:
+            logger.warning("Acquired leader lease %s with fencing token %s", self.path, lease['token'])
+        self._grant(lease['token'], started)
+        return True
+
+    def renew(self):
+        """
+        Extend our lease. Returns False (and drops leadership) if it was taken over.
+        """
+        if self.token is None:
+            return False
+        started = time.monotonic()
+        now = time.time()
+
+        def update(lease):
+            if lease.get('owner') != self.owner or lease.get('token') != self.token:
+                return None
+            return dict(lease, expires_at=now + self.ttl, heartbeat_at=now)
+
+        if self._locked(update) is None:
+            logger.warning("Leader lease %s was taken over; stepping down (token %s)", self.path, self.token)
+            self.token = None
+            return False
+        self._grant(self.token, started)
+        return True
+
+    def is_leader(self):
+        # Cheap local check, no file access
+        return self.token is not None and time.monotonic() < self._valid_until
+
+    def ensure(self):
+        """
+        Renew the lease if a heartbeat is due. Returns True while this instance leads.
+        """
+        if self.token is None:
+            return False
+        if not self.is_leader():
+            # We were stalled past our own deadline; another instance may already lead
+            return self.renew()
+        if time.monotonic() >= self._renew_after:
+            return self.renew()
+        return True
+
+    def fence(self):
+        """
+        Raise LeaseLost unless this instance still holds the lease. Call before any
+        side effect (a Telegram send, a state file write).
+        """
+        if not self.ensure():
+            raise LeaseLost(f"Leader lease {self.path} is no longer held by {self.owner}")
+
+    def wait_for_leadership(self, poll_interval=None):
+        """
+        Block until this instance becomes the leader.
+        """
+        poll_interval = poll_interval or self.heartbeat
+        while not self.try_acquire():
+            time.sleep(poll_interval)
+
+    def release(self):
+        """
+        Give the lease up immediately so a standby can take over without waiting for expiry.
+        """
+        if self.token is None:
+            return
+
+        def update(lease):
+            if lease.get('owner') != self.owner or lease.get('token') != self.token:
+                return None
+            return dict(lease, expires_at=0)
+
+        self._locked(update)
+        self.token = None
+
+
+# Small demo loop: run it in two terminals against the same lease file, then stop
+# (Ctrl+C), freeze (kill -STOP) or resume (kill -CONT) either process to watch failover.
+def main():
+    parser = argparse.ArgumentParser(description="Leader lease demo")
+    parser.add_argument('lease_file')
+    parser.add_argument('--ttl', type=float, default=6.0)
+    parser.add_argument('--heartbeat', type=float, default=1.0)
+    parser.add_argument('--owner', default=None)
+    args = parser.parse_args()
+
+    lease = LeaderLease(args.lease_file, ttl=args.ttl, heartbeat=args.heartbeat, owner=args.owner)
+    try:
+        while True:
+            if not lease.ensure() and not lease.try_acquire():
+                print(f"{lease.owner}: standby", flush=True)
+            else:
+                print(f"{lease.owner}: leader (token {lease.token})", flush=True)
+            time.sleep(args.heartbeat)
+    except KeyboardInterrupt:
+        lease.release()
+
+
+if __name__ == "__main__":
+    main()
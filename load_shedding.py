@@ -0,0 +1,78 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Degradation levels, from full service to the bare minimum
+NORMAL = 0             # map in every topic
+NO_KEYWORD_MAPS = 1    # keyword topics (Gore, Športne aktivnosti, ...) get text only
+TEXT_ONLY = 2          # no maps at all
+ALL_ONLY = 3           # text in the All topic only
+
+LEVEL_NAMES = {
+    NORMAL: "normal",
+    NO_KEYWORD_MAPS: "no maps in keyword topics",
+    TEXT_ONLY: "text only",
+    ALL_ONLY: "All topic only",
+}
+
+
+class LoadShedder:
+    """
+    Pick a degradation level from the number of incidents still waiting to be posted.
+
+    The level goes up one step while the backlog reaches enter[level] incidents, or while
+    the backlog would take longer than latency_target seconds to drain at the current
+    level. It comes down one step only once the backlog falls to leave[level - 1] and
+    could be drained at the lower level within half the latency target, so the level does
+    not flap around a threshold.
+
+    Parameters:
+        enter (tuple): Backlog sizes that raise the level to 1, 2 and 3.
+        leave (tuple): Backlog sizes at which levels 1, 2 and 3 are left again (lower than enter).
+        latency_target (float): Seconds within which the newest waiting incident should be posted.
+    """
+
+    def __init__(self, enter=(5, 15, 40), leave=(2, 8, 25), latency_target=120.0):
+        if len(enter) != ALL_ONLY or len(leave) != ALL_ONLY:
+            raise ValueError("Load shedding needs three enter and three leave thresholds.")
+        if any(low >= high for low, high in zip(leave, enter)):
+            raise ValueError("Load shedding leave thresholds must be below the enter thresholds.")
+        self.enter = tuple(enter)
+        self.leave = tuple(leave)
+        self.latency_target = latency_target
+        self.level = NORMAL
+        # Smoothed seconds spent per incident at each level (None until measured)
+        self.cost = {level: None for level in LEVEL_NAMES}
+
+    def record(self, seconds, level=None):
+        """
+        Feed back how long posting one incident took at the given (default: current) level.
+        """
+        level = self.level if level is None else level
+        previous = self.cost[level]
+        self.cost[level] = seconds if previous is None else 0.8 * previous + 0.2 * seconds
+
+    def projected_drain(self, depth, level):
+        # Seconds to post depth incidents at level, 0 while the cost is unknown
+        cost = self.cost[level]
+        return depth * cost if cost is not None else 0.0
+
+    def update(self, depth):
+        """
+        Re-evaluate the level for a backlog of depth incidents and return it.
+        """
+        level = self.level
+        while level < ALL_ONLY and (depth >= self.enter[level]
+                                    or self.projected_drain(depth, level) > self.latency_target):
+            level += 1
+        if level == self.level:
+            while level > NORMAL and (depth <= self.leave[level - 1]
+                                      and self.projected_drain(depth, level - 1) <= self.latency_target / 2):
+                level -= 1
+
+        if level != self.level:
+            log = logger.warning if level > self.level else logger.info
+            log("Load shedding level %s -> %s (%s) with %s incidents waiting",
+                self.level, level, LEVEL_NAMES[level], depth)
+            self.level = level
+        return level
@@ -0,0 +1,145 @@
+import queue
+import atexit
+import logging
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Let through at most `burst` records per message template every `interval` seconds,
+    then only every `sample`-th one (0 drops them all) until the window ends.
+
+    Records are grouped by logger, level and the unformatted message (record.msg), so
+    "Checking incident ID: %s" is one group no matter which ID is logged. The first
+    record let through after a window with drops says how many were suppressed.
+    Records at or above `always_level` are never limited.
+    """
+
+    def __init__(self, burst=20, interval=60.0, sample=100, always_level=logging.ERROR):
+        super().__init__()
+        self.burst = burst
+        self.interval = interval
+        self.sample = sample
+        self.always_level = always_level
+        self._windows = {}  # key -> [window start, records seen, records suppressed]
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno >= self.always_level:
+            return True
+        key = (record.name, record.levelno, record.msg)
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= self.interval:
+                suppressed = window[2] if window else 0
+                window = self._windows[key] = [now, 0, 0]
+                if len(self._windows) > 10000:
+                    # Templates are a fixed set in practice; guard against unbounded growth anyway
+                    self._windows = {key: window}
+            else:
+                suppressed = 0
+            window[1] += 1
+            seen = window[1]
+            allowed = seen <= self.burst or (self.sample and (seen - self.burst) % self.sample == 0)
+            if not allowed:
+                window[2] += 1
+                return False
+            if window[2] and seen > self.burst:
+                suppressed, window[2] = window[2], 0
+        if suppressed:
+            record.msg = f"{record.msg} [{suppressed} similar messages suppressed]"
+        return True
+
+
+class DeferredQueueHandler(QueueHandler):
+    """
+    QueueHandler that leaves formatting of the message and its arguments to the
+    listener thread, so the caller (the asyncio event loop) only pays for putting the
+    record on the queue. Arguments are therefore formatted a moment later; log values,
+    not objects that are mutated right after the call.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            # Never block the event loop on a slow disk; drop the record instead
+            self.dropped += 1
+
+
+# Listener started by configure_logging, stopped at exit so queued records are flushed
+_listener = None
+_queue_handler = None
+
+
+def configure_logging(level='CRITICAL', log_file='SPIN112_bot_errors.log', max_bytes=5 * 1024 * 1024,
+                      backup_count=3, rate_limit=None, queue_size=10000):
+    """
+    Route all logging through a bounded queue to a background thread that writes to a
+    size-rotated file and to stderr.
+
+    Parameters:
+        level (str|int): Root log level (e.g. 'CRITICAL', 'INFO', 'DEBUG').
+        log_file (str): Log file path; rotated at max_bytes, keeping backup_count old files.
+        rate_limit (RateLimitFilter|None): Filter applied before records are queued.
+        queue_size (int): Records waiting to be written; when full, new records are dropped
+            instead of blocking the caller.
+    """
+    global _listener, _queue_handler
+    if _listener is not None:
+        _listener.stop()
+
+    formatter = logging.Formatter(LOG_FORMAT)
+    file_handler = RotatingFileHandler(log_file, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8')
+    stream_handler = logging.StreamHandler()
+    for handler in (file_handler, stream_handler):
+        handler.setFormatter(formatter)
+
+    log_queue = queue.Queue(queue_size)
+    queue_handler = _queue_handler = DeferredQueueHandler(log_queue)
+    if rate_limit is not None:
+        queue_handler.addFilter(rate_limit)
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+    # The HTTP client logs every request at INFO; keep it out of verbose runs
+    logging.getLogger('httpx').setLevel(max(root.level, logging.WARNING))
+
+    _listener = QueueListener(log_queue, file_handler, stream_handler, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+
+def dropped_records():
+    """
+    Records dropped so far because the queue was full.
+    """
+    return _queue_handler.dropped if _queue_handler is not None else 0
+
+
+def stop_logging():
+    """
+    Flush queued records and stop the writer thread.
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(stop_logging)
@@ -0,0 +1,194 @@
+import os
+import ctypes
+import inspect
+import importlib.util
+import tracemalloc
+
+MB = 1024 * 1024
+
+
+def resident_memory_bytes():
+    """
+    Current resident set size of the process, or None where /proc is not available.
+    """
+    try:
+        with open('/proc/self/statm', 'r') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def trim_heap():
+    """
+    Give freed heap memory back to the operating system (glibc only, a no-op elsewhere).
+    Freed memory otherwise stays in the resident set after a large temporary allocation,
+    such as parsing a GeoJSON file or rendering a map.
+    """
+    try:
+        ctypes.CDLL('libc.so.6').malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+
+def start_tracing(frames):
+    """
+    Start tracemalloc with the given traceback depth, unless it is already running
+    (e.g. with PYTHONTRACEMALLOC). Allocations made before this call are not traced.
+    """
+    if frames > 0 and not tracemalloc.is_tracing():
+        tracemalloc.start(frames)
+
+
+def parse_budgets(text):
+    """
+    Parse per-subsystem budgets in MB, e.g. "geodata=10,maps=40", into bytes.
+    """
+    budgets = {}
+    for item in text.split(','):
+        if item.strip():
+            name, _, megabytes = item.partition('=')
+            budgets[name.strip()] = int(float(megabytes) * MB)
+    return budgets
+
+
+def _format_mb(size):
+    return '-' if size is None else f"{size / MB:.1f} MB"
+
+
+class MemoryReport:
+    """
+    Resident memory of the process and the traced memory of each subsystem, with budgets.
+    Sizes are in bytes; traced sizes are None when tracemalloc is not running.
+    """
+
+    def __init__(self, resident, budget, subsystems, budgets, tracing_overhead):
+        self.resident = resident
+        self.budget = budget
+        self.subsystems = subsystems  # name -> traced bytes (None when not tracing)
+        self.budgets = budgets  # name -> budget bytes
+        self.tracing_overhead = tracing_overhead
+
+    @property
+    def traced(self):
+        if any(size is None for size in self.subsystems.values()):
+            return None
+        return sum(self.subsystems.values())
+
+    def over_budget(self):
+        """
+        Names over their budget; 'resident' stands for the process as a whole.
+        """
+        over = []
+        if self.budget and self.resident and self.resident > self.budget:
+            over.append('resident')
+        for name, size in self.subsystems.items():
+            if size is not None and name in self.budgets and size > self.budgets[name]:
+                over.append(name)
+        return over
+
+    def format(self):
+        lines = [f"{'':<14}{'memory':>12}{'budget':>12}"]
+        lines.append(f"{'resident':<14}{_format_mb(self.resident):>12}{_format_mb(self.budget):>12}")
+        if self.traced is None:
+            lines.append("Per-subsystem memory needs tracemalloc (SPIN112_MEMORY_TRACE_FRAMES).")
+            return '\n'.join(lines)
+        for name, size in self.subsystems.items():
+            lines.append(f"{name:<14}{_format_mb(size):>12}{_format_mb(self.budgets.get(name)):>12}")
+        lines.append(f"{'traced total':<14}{_format_mb(self.traced):>12}")
+        if self.resident:
+            # Interpreter, imported modules, C libraries (GEOS, PIL pixel data) and freed heap
+            lines.append(f"{'untraced':<14}{_format_mb(max(0, self.resident - self.traced)):>12}")
+        lines.append(f"{'tracemalloc':<14}{_format_mb(self.tracing_overhead):>12}")
+        return '\n'.join(lines)
+
+    def __str__(self):
+        return self.format()
+
+
+class MemoryReporter:
+    """
+    Attributes the memory traced by tracemalloc to subsystems by where it was allocated.
+
+    subsystems is a list of (name, targets) pairs. A target is a module or package name
+    (everything allocated in its files) or a function (everything allocated in its body).
+    For every live allocation the traceback is walked from the most recent frame and the
+    first frame matching a target decides the subsystem; the rest is 'other'. Functions
+    are matched before modules, so a function in a module listed under another subsystem
+    is still counted under its own.
+    """
+
+    def __init__(self, subsystems, budget=None, budgets=None):
+        self.names = [name for name, _targets in subsystems] + ['other']
+        self.budget = budget
+        self.budgets = budgets or {}
+        self._functions = {}  # filename -> [(first line, last line, subsystem)]
+        self._modules = []  # (path or directory prefix, subsystem)
+        self._frames = {}  # (filename, lineno) -> subsystem or None, cached
+        for name, targets in subsystems:
+            for target in targets:
+                if isinstance(target, str):
+                    self._add_module(target, name)
+                else:
+                    self._add_function(target, name)
+
+    def _add_module(self, module, subsystem):
+        try:
+            spec = importlib.util.find_spec(module)
+        except (ImportError, ValueError):
+            spec = None
+        if spec is None or not spec.origin:
+            return
+        if spec.submodule_search_locations:
+            for location in spec.submodule_search_locations:
+                self._modules.append((os.path.join(os.path.abspath(location), ''), subsystem))
+        else:
+            self._modules.append((os.path.abspath(spec.origin), subsystem))
+
+    def _add_function(self, function, subsystem):
+        function = inspect.unwrap(function)
+        try:
+            lines, first = inspect.getsourcelines(function)
+        except (OSError, TypeError):
+            return
+        filename = os.path.abspath(function.__code__.co_filename)
+        self._functions.setdefault(filename, []).append((first, first + len(lines) - 1, subsystem))
+
+    def _frame_subsystem(self, filename, lineno):
+        key = (filename, lineno)
+        if key not in self._frames:
+            path = os.path.abspath(filename)
+            subsystem = None
+            for first, last, name in self._functions.get(path, ()):
+                if first <= lineno <= last:
+                    subsystem = name
+                    break
+            else:
+                for prefix, name in self._modules:
+                    if path == prefix or (prefix.endswith(os.sep) and path.startswith(prefix)):
+                        subsystem = name
+                        break
+            self._frames[key] = subsystem
+        return self._frames[key]
+
+    def _subsystem(self, traceback):
+        for frame in reversed(traceback):
+            subsystem = self._frame_subsystem(frame.filename, frame.lineno)
+            if subsystem is not None:
+                return subsystem
+        return 'other'
+
+    def report(self):
+        """
+        Take a snapshot and return a MemoryReport. Grouping the snapshot takes longer
+        the more objects are alive; run it off the event loop.
+        """
+        resident = resident_memory_bytes()  # before the snapshot adds to it
+        subsystems = dict.fromkeys(self.names)
+        overhead = None
+        if tracemalloc.is_tracing():
+            snapshot = tracemalloc.take_snapshot()
+            subsystems = dict.fromkeys(self.names, 0)
+            for statistic in snapshot.statistics('traceback'):
+                subsystems[self._subsystem(statistic.traceback)] += statistic.size
+            overhead = tracemalloc.get_tracemalloc_memory()
+        return MemoryReport(resident, self.budget, subsystems, self.budgets, overhead)
@@ -0,0 +1,183 @@
+import os
+import io
+import json
+import time
+import pstats
+import cProfile
+import logging
+import functools
+import contextvars
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+
+class _NoSpan:
+    # Shared do-nothing context manager returned by span() while nothing is traced
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+class _Span:
+    def __init__(self, trace, name, attrs):
+        self._trace = trace
+        self._name = name
+        self._attrs = attrs
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        ended = time.perf_counter()
+        attrs = dict(self._attrs)
+        if exc_type is not None:
+            attrs['error'] = exc_type.__name__
+        self._trace.add(self._name, self._started, ended, attrs)
+        return False
+
+
+class SpanTrace:
+    """
+    Wall-clock spans of one profiled job run, saved in the Chrome trace event format
+    (open the file in https://ui.perfetto.dev or chrome://tracing).
+    """
+
+    def __init__(self, job):
+        self.job = job
+        self.origin = time.perf_counter()
+        self.events = []
+
+    def add(self, name, started, ended, attrs):
+        self.events.append({
+            'name': name,
+            'ph': 'X',
+            'ts': round((started - self.origin) * 1e6),
+            'dur': round((ended - started) * 1e6),
+            'pid': os.getpid(),
+            'tid': 1,
+            'args': attrs,
+        })
+
+    def dump(self, path):
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump({'traceEvents': self.events, 'displayTimeUnit': 'ms',
+                       'otherData': {'job': self.job}}, file, ensure_ascii=False)
+
+
+# Trace of the job run the current asyncio task belongs to (each job run is its own task)
+_current_trace = contextvars.ContextVar('spin112_trace', default=None)
+# Number of traces being recorded; span() only looks at the context variable while it is non-zero
+_active_traces = 0
+
+
+def span(name, **attrs):
+    """
+    Time a block as a span of the current profiled run:
+
+        with profiling.span('incident', id=incident_id):
+            ...
+
+    Returns a shared no-op context manager when no run is being profiled.
+    """
+    if not _active_traces:
+        return _NO_SPAN
+    trace = _current_trace.get()
+    if trace is None:
+        return _NO_SPAN
+    return _Span(trace, name, attrs)
+
+
+class Profiler:
+    """
+    Arms cProfile and span tracing for the next N runs of selected jobs.
+
+    Jobs wrapped with profiler.job(name) check a single dict lookup per run while
+    disarmed. When armed, a run is executed under cProfile (only one run at a time,
+    since Python allows a single active profiler per thread) and with span tracing,
+    and three files are written to output_dir:
+
+        <timestamp>-<job>.prof        raw cProfile stats (snakeviz, pstats)
+        <timestamp>-<job>.txt         top functions by cumulative time
+        <timestamp>-<job>.trace.json  wall-clock spans (Chrome trace event format)
+    """
+
+    def __init__(self, output_dir='profiles', top=40):
+        self.output_dir = output_dir
+        self.top = top
+        self.armed = {}  # job name -> remaining runs to profile
+        self._profiling = False
+
+    def arm(self, runs, jobs):
+        """
+        Profile the next runs runs of each of the given jobs.
+        """
+        for job in jobs:
+            self.armed[job] = runs
+        logger.warning("Profiling armed for the next %s run(s) of %s", runs, ', '.join(jobs))
+
+    def disarm(self):
+        self.armed.clear()
+
+    def job(self, name):
+        """
+        Decorator for an async job function.
+        """
+        def decorate(func):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                if not self.armed.get(name):
+                    return await func(*args, **kwargs)
+                return await self._run_profiled(name, func, args, kwargs)
+            return wrapper
+        return decorate
+
+    async def _run_profiled(self, name, func, args, kwargs):
+        global _active_traces
+        self.armed[name] -= 1
+        if not self.armed[name]:
+            del self.armed[name]
+
+        trace = SpanTrace(name)
+        token = _current_trace.set(trace)
+        _active_traces += 1
+        profile = None
+        if not self._profiling:
+            # cProfile sees everything on the event loop thread while enabled, including
+            # other jobs that interleave with this run
+            self._profiling = True
+            profile = cProfile.Profile()
+            profile.enable()
+        started = time.perf_counter()
+        try:
+            with span('run', job=name):
+                return await func(*args, **kwargs)
+        finally:
+            if profile is not None:
+                profile.disable()
+                self._profiling = False
+            _active_traces -= 1
+            _current_trace.reset(token)
+            self._write(name, profile, trace, time.perf_counter() - started)
+
+    def _write(self, name, profile, trace, elapsed):
+        try:
+            os.makedirs(self.output_dir, exist_ok=True)
+            base = os.path.join(self.output_dir, f"{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}-{name}")
+            trace.dump(f"{base}.trace.json")
+            if profile is not None:
+                profile.dump_stats(f"{base}.prof")
+                summary = io.StringIO()
+                summary.write(f"{name}: {elapsed:.3f} s wall clock\n\n")
+                pstats.Stats(profile, stream=summary).sort_stats('cumulative').print_stats(self.top)
+                with open(f"{base}.txt", 'w', encoding='utf-8') as file:
+                    file.write(summary.getvalue())
+            logger.warning("Profiled %s in %.3f s, written to %s.*", name, elapsed, base)
+        except OSError as e:
+            logger.error("Failed to write profile of %s: %s", name, e)